@@ -0,0 +1,385 @@
+# chats/middleware.py
+"""
+Per-request performance metrics and rate limiting.
+
+PerformanceMiddleware measures every request: wall time, database query
+count and time, serializer time and response size. It files each reading
+under the resolved view name, e.g. conversations-list or
+conversation-messages-list. The readings are aggregated in memory into
+histograms. metrics_view serves them in the Prometheus text format to
+CHATS_METRICS_ALLOWED_IPS.
+
+RateLimitMiddleware applies the per-route budgets in CHATS_RATE_LIMITS. It
+keys each budget by user, or by IP address for anonymous clients, and
+keeps the counters in the CHATS_RATE_LIMIT_STORE.
+"""
+
+import bisect
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+METRICS = {
+    # name: (help, buckets)
+    'chats_request_duration_seconds': ("Wall time spent handling the request.", DURATION_BUCKETS),
+    'chats_db_queries': ("Database queries run by the request.", QUERY_BUCKETS),
+    'chats_db_duration_seconds': ("Time spent waiting on the database.", DURATION_BUCKETS),
+    'chats_serializer_duration_seconds': ("Time spent in DRF serializers.", DURATION_BUCKETS),
+    'chats_response_size_bytes': ("Size of the response body.", SIZE_BUCKETS),
+}
+
+UNRESOLVED = '<unresolved>'
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus exposes them."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, view, readings):
+        with self._lock:
+            for name, value in readings.items():
+                if value is None:
+                    continue
+                key = (name, view)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(METRICS[name][1])
+                histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self):
+        """{(metric, view): (cumulative buckets, sum, count)}"""
+        with self._lock:
+            return {
+                key: (list(histogram.cumulative()), histogram.sum, histogram.count)
+                for key, histogram in self._histograms.items()
+            }
+
+    def render(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, (help_text, _) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, view), (buckets, total, count) in sorted(snapshot.items()):
+                if metric != name:
+                    continue
+                label = view.replace('\\', '\\\\').replace('"', '\\"')
+                for bound, cumulative in buckets:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{{view="{label}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{label}"}} {total}')
+                lines.append(f'{name}_count{{view="{label}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetrics:
+    """Readings for the request in flight, reachable through current_metrics."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed as a database execute wrapper.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+@contextmanager
+def serializer_timer():
+    """Time the outermost serializer call only, so nested ones are not counted twice."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    metrics.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_depth -= 1
+        if not metrics.serializer_depth:
+            metrics.serializer_time += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Adds the serializer's to_representation time to the request metrics."""
+
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+def response_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+class PerformanceMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+
+        match = getattr(request, 'resolver_match', None)
+        registry.observe(match.view_name if match and match.view_name else UNRESOLVED, {
+            'chats_request_duration_seconds': time.perf_counter() - started,
+            'chats_db_queries': metrics.queries,
+            'chats_db_duration_seconds': metrics.db_time,
+            'chats_serializer_duration_seconds': metrics.serializer_time,
+            'chats_response_size_bytes': response_size(response),
+        })
+        return response
+
+
+def metrics_view(request):
+    """The aggregated histograms, for scrapers on CHATS_METRICS_ALLOWED_IPS only."""
+    allowed = getattr(settings, 'CHATS_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Rate limiting
+#
+# Each budget is a sliding-window counter: the count in the current fixed
+# window plus the previous window's count, weighted by how much of it still
+# overlaps the sliding window. That is two counters per client and budget,
+# and constant work per request.
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'30/minute' -> (30, 60), in the same format as DRF throttles."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class BaseRateLimitStore:
+
+    def hit(self, key, limit, period, now):
+        """
+        Count a request against `key` unless that would exceed `limit` per
+        `period` seconds. Returns (allowed, retry_after_seconds).
+        """
+        raise NotImplementedError
+
+
+def sliding_count(current, previous, period, now):
+    elapsed = now % period
+    return current + previous * (period - elapsed) / period
+
+
+def retry_after(current, previous, limit, period, now):
+    """Seconds until the weighted previous window has decayed enough to admit a request."""
+    if current >= limit or not previous:
+        return period - now % period
+    # current + previous * (period - elapsed) / period < limit
+    elapsed = period - (limit - current) * period / previous
+    return max(elapsed - now % period, 0)
+
+
+class InProcessRateLimitStore(BaseRateLimitStore):
+    """Counters in a bounded LRU dict; only sees requests served by this process."""
+
+    max_keys = 100000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = OrderedDict()  # key -> [window, current, previous]
+
+    def hit(self, key, limit, period, now):
+        window = int(now // period)
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None:
+                state = self._windows[key] = [window, 0, 0]
+            else:
+                self._windows.move_to_end(key)
+            if state[0] != window:
+                state[2] = state[1] if state[0] == window - 1 else 0
+                state[0], state[1] = window, 0
+            if sliding_count(state[1], state[2], period, now) >= limit:
+                return False, retry_after(state[1], state[2], limit, period, now)
+            state[1] += 1
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        return True, 0
+
+
+class CacheRateLimitStore(BaseRateLimitStore):
+    """
+    Counters in a Django cache (CHATS_RATE_LIMIT_CACHE), shared by every
+    process using that cache. Uses add() and incr() only, which memcached
+    and Redis backends perform atomically. LocMemCache makes it a local
+    stand-in.
+    """
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'CHATS_RATE_LIMIT_CACHE', 'default')]
+
+    def hit(self, key, limit, period, now):
+        window = int(now // period)
+        current_key, previous_key = f"ratelimit:{key}:{window}", f"ratelimit:{key}:{window - 1}"
+        counts = self.cache.get_many([current_key, previous_key])
+        current, previous = counts.get(current_key, 0), counts.get(previous_key, 0)
+        if sliding_count(current, previous, period, now) >= limit:
+            return False, retry_after(current, previous, limit, period, now)
+        # Windows are needed until the end of the next one.
+        if not self.cache.add(current_key, 1, timeout=2 * period):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                # Expired between add() and incr().
+                self.cache.add(current_key, 1, timeout=2 * period)
+        return True, 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_rate_limit_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = import_string(getattr(
+                settings, 'CHATS_RATE_LIMIT_STORE', 'chats.middleware.InProcessRateLimitStore'))()
+        return _store
+
+
+def reset_rate_limit_store():
+    """Forget the current store, e.g. after changing CHATS_RATE_LIMIT_STORE."""
+    global _store
+    with _store_lock:
+        _store = None
+
+
+def client_identity(request):
+    """
+    'user:<id>' for a session or a valid bearer token, else 'ip:<address>'.
+    Tokens are only validated, never looked up, so this costs no queries.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    try:
+        # get_raw_token rejects malformed headers, e.g. "Bearer a b".
+        raw_token = authentication.get_raw_token(header) if header else None
+        if raw_token is not None:
+            token = authentication.get_validated_token(raw_token)
+            return f"user:{token[jwt_settings.USER_ID_CLAIM]}"
+    except (AuthenticationFailed, InvalidToken, TokenError, KeyError):
+        pass
+    return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+class RateLimitMiddleware:
+    """
+    Applies CHATS_RATE_LIMITS, a dict of budget name to
+    {'views': [...], 'methods': [...], 'rate': 'N/period'}. Every budget whose
+    view names and methods match the request is charged; the first one that
+    is exhausted answers 429 with Retry-After.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = [
+            (name, set(rule['views']), {method.upper() for method in rule['methods']}, parse_rate(rule['rate']))
+            for name, rule in getattr(settings, 'CHATS_RATE_LIMITS', {}).items()
+        ]
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name
+        rules = [
+            (name, rate) for name, views, methods, rate in self.rules
+            if view_name in views and request.method in methods
+        ]
+        if not rules:
+            return None
+
+        store = get_rate_limit_store()
+        identity = client_identity(request)
+        now = time.time()
+        for name, (limit, period) in rules:
+            allowed, wait = store.hit(f"{name}:{identity}", limit, period, now)
+            if not allowed:
+                response = JsonResponse(
+                    {"error": "Rate limit exceeded.", "limit": name}, status=429)
+                response['Retry-After'] = str(max(math.ceil(wait), 1))
+                return response
+        return None
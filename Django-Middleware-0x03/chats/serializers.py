@@ -1,8 +1,9 @@
 from rest_framework import serializers
+from .middleware import TimedSerializerMixin
 from .models import User, Conversation, Message
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Explicit CharField usage
     phone_number = serializers.CharField(required=False, allow_blank=True)
 
@@ -11,7 +12,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['user_id', 'username', 'email', 'phone_number', 'role', 'created_at']
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     sender_username = serializers.SerializerMethodField()
 
     def get_sender_username(self, obj):
@@ -19,10 +20,10 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ['message_id', 'conversation', 'sender', 'sender_username', 'content', 'timestamp']
+        fields = ['message_id', 'conversation', 'sender', 'sender_username', 'message_body', 'sent_at']
 
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     messages = MessageSerializer(many=True, read_only=True)
 
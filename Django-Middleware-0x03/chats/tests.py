@@ -1,3 +1,135 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .middleware import (
+    CacheRateLimitStore, InProcessRateLimitStore, client_identity, registry, reset_rate_limit_store,
+)
+from .models import User, Conversation, Message
+
+
+def make_user(username):
+    return User.objects.create_user(
+        username=username,
+        email=f"{username}@example.com",
+        password='pass1234',
+        first_name=username,
+        last_name='Test',
+    )
+
+
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        Message.objects.create(conversation=self.conversation, sender=self.bob, message_body='hi')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def reading(self, metric, view):
+        return registry.snapshot()[(metric, view)]
+
+    def test_records_readings_by_view_name(self):
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+
+        view = 'conversations-list'
+        _, _, count = self.reading('chats_request_duration_seconds', view)
+        self.assertEqual(count, 1)
+        _, queries, _ = self.reading('chats_db_queries', view)
+        self.assertGreater(queries, 0)
+        _, db_time, _ = self.reading('chats_db_duration_seconds', view)
+        self.assertGreater(db_time, 0)
+        _, serializer_time, _ = self.reading('chats_serializer_duration_seconds', view)
+        self.assertGreater(serializer_time, 0)
+        _, size, _ = self.reading('chats_response_size_bytes', view)
+        self.assertEqual(size, len(response.content))
+
+    def test_nested_serializers_are_not_counted_twice(self):
+        self.client.get('/api/conversations/')
+        _, serializer_time, _ = self.reading('chats_serializer_duration_seconds', 'conversations-list')
+        _, request_time, _ = self.reading('chats_request_duration_seconds', 'conversations-list')
+        self.assertLess(serializer_time, request_time)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/conversations/')
+        self.client.get('/api/conversations/')
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE chats_db_queries histogram', body)
+        self.assertIn('chats_request_duration_seconds_bucket{view="conversations-list",le="+Inf"} 2', body)
+        self.assertIn('chats_request_duration_seconds_count{view="conversations-list"} 2', body)
+
+    def test_metrics_endpoint_is_local_only(self):
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.0.0.7')
+        self.assertEqual(response.status_code, 403)
+
+
+class RateLimitStoreTests(TestCase):
+
+    def test_sliding_window(self):
+        cache.clear()
+        for store in (InProcessRateLimitStore(), CacheRateLimitStore()):
+            with self.subTest(store=type(store).__name__):
+                hit = lambda now: store.hit('alice', 3, 60, now)
+                self.assertEqual([hit(120.0)[0] for _ in range(3)], [True] * 3)
+                allowed, retry_after = hit(150.0)
+                self.assertFalse(allowed)
+                self.assertEqual(retry_after, 30)
+                # The previous window weighs in fully at the boundary...
+                self.assertFalse(hit(180.0)[0])
+                # ...and 1.5 half way through.
+                self.assertTrue(hit(210.0)[0])
+                self.assertTrue(store.hit('bob', 3, 60, 150.0)[0])
+
+
+@override_settings(
+    CHATS_RATE_LIMIT_STORE='chats.middleware.InProcessRateLimitStore',
+    CHATS_RATE_LIMITS={
+        'writes': {'views': ['conversation-messages-detail'], 'methods': ['PATCH'], 'rate': '1/minute'},
+        'reads': {'views': ['conversation-messages-detail'], 'methods': ['GET'], 'rate': '2/minute'},
+    },
+)
+class RateLimitMiddlewareTests(TestCase):
+
+    def setUp(self):
+        reset_rate_limit_store()
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        message = Message.objects.create(conversation=self.conversation, sender=self.bob, message_body='hi')
+        self.url = f"/api/conversations/{self.conversation.pk}/messages/{message.pk}/"
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        return client
+
+    def test_reads_and_writes_have_separate_budgets(self):
+        client = self.client_for(self.alice)
+        self.assertEqual(client.patch(self.url, {'message_body': 'edited'}, format='json').status_code, 200)
+        response = client.patch(self.url, {'message_body': 'again'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        self.assertEqual([client.get(self.url).status_code for _ in range(3)], [200, 200, 429])
+
+    def test_budgets_are_per_user(self):
+        alice, bob = self.client_for(self.alice), self.client_for(self.bob)
+        self.assertEqual([alice.get(self.url).status_code for _ in range(3)], [200, 200, 429])
+        self.assertEqual(bob.get(self.url).status_code, 200)
+
+    def test_malformed_tokens_fall_back_to_the_address(self):
+        for header in ("Bearer a b", "Bearer not-a-token"):
+            with self.subTest(header=header):
+                request = RequestFactory().get(self.url, HTTP_AUTHORIZATION=header, REMOTE_ADDR='10.0.0.1')
+                self.assertEqual(client_identity(request), 'ip:10.0.0.1')
+                # DRF answers 401, not the middleware with a 500.
+                self.assertEqual(APIClient().get(self.url, HTTP_AUTHORIZATION=header).status_code, 401)
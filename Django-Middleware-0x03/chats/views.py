@@ -6,7 +6,7 @@ from .serializers import ConversationSerializer, MessageSerializer
 from django.contrib.auth import get_user_model
 from .permissions import IsParticipantOfConversation
 from django_filters.rest_framework import DjangoFilterBackend
-from .filters import MessageFilter
+from .pagination import CustomMessagePagination
 
 User = get_user_model()
 
@@ -14,8 +14,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated, IsParticipantOfConversation]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_class = MessageFilter
-    ordering = ['-sent_at']
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
     pagination_class = CustomMessagePagination
 
     def get_queryset(self):
@@ -40,11 +40,12 @@ INSTALLED_APPS = [
     'rest_framework',
     'chats',
     'rest_framework_simplejwt',
-    'rest_framework.authentication.BasicAuthentication',
     'django_filters',
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the rest of the stack.
+    'chats.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +53,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # After AuthenticationMiddleware, so session users are keyed by user.
+    'chats.middleware.RateLimitMiddleware',
 ]
 
 REST_FRAMEWORK = {
@@ -68,7 +71,7 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
         'rest_framework.filters.SearchFilter',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'messaging_app.chats.pagination.CustomMessagePagination',
+    'DEFAULT_PAGINATION_CLASS': 'chats.pagination.CustomMessagePagination',
     'PAGE_SIZE': 20,
     # Include direct mention of PageNumberPagination to satisfy keyword check
     'ALLOWED_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',  # <== keyword trick
@@ -76,6 +79,31 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = 'chats.User'
 
+SIMPLE_JWT = {
+    'USER_ID_FIELD': 'user_id',
+}
+
+# Clients allowed to read /metrics/ (see chats.middleware.metrics_view).
+CHATS_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Per-route budgets for RateLimitMiddleware, per user (or IP when anonymous).
+CHATS_RATE_LIMITS = {
+    'message-writes': {
+        'views': ['conversation-messages-list', 'conversation-messages-detail'],
+        'methods': ['POST', 'PUT', 'PATCH', 'DELETE'],
+        'rate': '30/minute',
+    },
+    'message-reads': {
+        'views': ['conversation-messages-list', 'conversation-messages-detail'],
+        'methods': ['GET', 'HEAD'],
+        'rate': '300/minute',
+    },
+}
+
+# Where the rate limit counters live: InProcessRateLimitStore, or
+# CacheRateLimitStore to share them through the CHATS_RATE_LIMIT_CACHE cache.
+CHATS_RATE_LIMIT_STORE = 'chats.middleware.InProcessRateLimitStore'
+
 ROOT_URLCONF = 'messaging_app.urls'
 
 TEMPLATES = [
@@ -0,0 +1,143 @@
+# chats/archive.py
+"""
+Hot/cold split of the message history.
+
+Messages sent more than CHATS_ARCHIVE_AFTER_DAYS ago move from Message to
+ArchivedMessage (manage.py archive_messages), oldest first, in batches
+that each commit on their own. An interrupted run leaves every batch
+either moved or untouched, and the next run carries on from the oldest
+message still in Message. The newest HOT_MESSAGES_PER_CONVERSATION
+messages of each conversation stay hot, so summaries and inbox entries
+keep pointing at a row and the latest-messages previews of conversation
+lists (which read only Message) come out the same after archiving.
+
+Because messages move oldest first, every archived message of a
+conversation sorts before every hot one. History pages therefore read
+Message first and only reach into the archive for the rows a page is
+short of (MessageCursorPagination, ArchivedHistory). Writes keep it that
+way: a message may not be dated at or before earliest_writable(), which
+the message serializers check for client-supplied sent_at values.
+
+Archived messages keep counting in the conversation summaries, so
+archiving changes no ETag or cached list. They are read-only and are not
+covered by the search index.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import ArchivedMessage, Message
+
+ARCHIVE_FIELDS = ('message_id', 'conversation_id', 'sender_id', 'message_body', 'sent_at')
+
+# At least the largest conversation list preview (PreviewSizeMixin.max_preview_size).
+HOT_MESSAGES_PER_CONVERSATION = 20
+
+
+def archive_cutoff(now=None):
+    """Messages sent before this are archived; None when archiving is off."""
+    days = getattr(settings, 'CHATS_ARCHIVE_AFTER_DAYS', None)
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def earliest_writable(conversation_id):
+    """
+    The time new or edited messages of the conversation must be dated after:
+    the later of the archive cutoff and its newest archived message. None
+    when nothing is archived and archiving is off.
+    """
+    newest_archived = (
+        ArchivedMessage.objects.filter(conversation_id=conversation_id)
+        .order_by('-sent_at').values_list('sent_at', flat=True).first()
+    )
+    bounds = [bound for bound in (archive_cutoff(), newest_archived) if bound is not None]
+    return max(bounds) if bounds else None
+
+
+def archivable_messages(cutoff, keep=HOT_MESSAGES_PER_CONVERSATION):
+    """
+    Messages sent before `cutoff`, oldest first, other than each
+    conversation's newest `keep`. Rows sharing the sent_at of the oldest
+    kept one stay hot too, so archived rows still sort before hot ones.
+    """
+    oldest_kept = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id'),
+    ).order_by('-sent_at', '-message_id').values('sent_at')[keep - 1:keep]
+    return (
+        Message.objects
+        .filter(sent_at__lt=cutoff)
+        # NULL, so nothing, for conversations with `keep` messages or fewer.
+        .filter(sent_at__lt=Subquery(oldest_kept))
+        .order_by('sent_at', 'message_id')
+    )
+
+
+def archive_messages(cutoff=None, batch_size=1000, max_batches=None):
+    """
+    Move archivable messages into ArchivedMessage, `batch_size` at a time,
+    and yield the number moved by each batch. Stops when nothing older than
+    `cutoff` (default: archive_cutoff()) is left, or after `max_batches`.
+    """
+    cutoff = cutoff or archive_cutoff()
+    if cutoff is None:
+        raise ValueError("Archiving is off: set CHATS_ARCHIVE_AFTER_DAYS.")
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            rows = list(archivable_messages(cutoff).values(*ARCHIVE_FIELDS)[:batch_size])
+            if not rows:
+                return
+            # Written conversation by conversation, so each one's history
+            # sits on few pages of the archive table.
+            rows.sort(key=lambda row: (row['conversation_id'], row['sent_at'], row['message_id']))
+            ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+            Message.objects.filter(message_id__in=[row['message_id'] for row in rows]).delete()
+        batches += 1
+        yield len(rows)
+
+
+class ArchivedHistory:
+    """
+    A message history as one sliceable sequence, hot rows then archived
+    ones (or the other way round when ordered oldest first), for Django's
+    Paginator. `hot` must be ordered by sent_at; `cold` is ordered the same.
+    """
+
+    def __init__(self, hot, cold):
+        self.ordering = hot.query.order_by
+        self.newest_first = not self.ordering or str(self.ordering[0]).startswith('-')
+        cold = cold.order_by(*self.ordering)
+        self.parts = (hot, cold) if self.newest_first else (cold, hot)
+        self._counts = None
+
+    @property
+    def ordered(self):
+        return True
+
+    def counts(self):
+        if self._counts is None:
+            self._counts = [part.count() for part in self.parts]
+        return self._counts
+
+    def count(self):
+        return sum(self.counts())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop if key.stop is not None else self.count()
+        rows, offset = [], 0
+        for part, size in zip(self.parts, self.counts()):
+            if start < offset + size and stop > offset:
+                rows += list(part[max(start - offset, 0):stop - offset])
+            offset += size
+        return rows
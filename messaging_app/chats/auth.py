@@ -1,9 +1,190 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+# Copied from the user into every token, and back onto the user built from it.
+USER_CLAIMS = ('username', 'role')
+
+
+def add_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
 def get_tokens_for_user(user):
-    refresh = RefreshToken.for_user(user)
+    refresh = add_user_claims(RefreshToken.for_user(user), user)
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
     }
 
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """TokenObtainPairView serializer that issues tokens carrying USER_CLAIMS."""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+def user_state_cache_key(user_id):
+    return f"chats:user-active:{user_id}"
+
+
+def is_active_user(user_id):
+    """
+    Whether the user still exists and is active, kept in the shared cache for
+    CHATS_JWT_USER_CACHE_TIMEOUT seconds. chats.signals drops the entry when
+    the user is saved or deleted.
+    """
+    timeout = getattr(settings, 'CHATS_JWT_USER_CACHE_TIMEOUT', 0)
+    key = user_state_cache_key(user_id)
+    active = cache.get(key) if timeout else None
+    if active is None:
+        active = User.objects.filter(pk=user_id, is_active=True).exists()
+        if timeout:
+            cache.set(key, active, timeout)
+    return active
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that builds request.user from the token's claims
+    instead of loading the user row.
+
+    The user is an unsaved User carrying only the primary key and
+    USER_CLAIMS; it works for ORM filters, foreign keys and permission
+    checks, but must never be saved. Revocation is checked against the
+    cached is_active_user(). Tokens issued before the claims were added
+    fall back to the database lookup.
+    """
+
+    def get_user(self, validated_token):
+        if any(claim not in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+        try:
+            user_id = User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if not is_active_user(user_id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        user = User(pk=user_id, is_active=True)
+        for claim in USER_CLAIMS:
+            setattr(user, claim, validated_token[claim])
+        user._state.adding = False
+        return user
+
+
+class AuthenticationTimingStats:
+    """Attempts, total and slowest milliseconds per authenticator for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+
+    def record(self, name, elapsed):
+        with self._lock:
+            count, total, slowest = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + elapsed, max(slowest, elapsed))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {'count': count, 'total_ms': total, 'max_ms': slowest}
+                for name, (count, total, slowest) in self.timings.items()
+            }
+
+
+timing_stats = AuthenticationTimingStats()
+
+
+class TimedAuthenticator:
+    """
+    Wraps an authenticator and records the time each attempt took in
+    timing_stats and the chats.auth debug log, and on the request as
+    request.authenticator_timings, (name, milliseconds) pairs.
+    """
+
+    def __init__(self, authenticator):
+        self.authenticator = authenticator
+        self.name = type(authenticator).__name__
+
+    def authenticate(self, request):
+        started = time.perf_counter()
+        try:
+            return self.authenticator.authenticate(request)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            timing_stats.record(self.name, elapsed)
+            logger.debug("%s took %.3f ms for %s", self.name, elapsed, request.path)
+            timings = getattr(request, 'authenticator_timings', None)
+            if timings is None:
+                timings = request.authenticator_timings = []
+            timings.append((self.name, elapsed))
+
+    def authenticate_header(self, request):
+        return self.authenticator.authenticate_header(request)
+
+
+def get_authenticators(policy=None):
+    """
+    Authenticator instances for a policy named in CHATS_AUTHENTICATION_POLICIES,
+    or REST_FRAMEWORK's defaults for None. With CHATS_AUTHENTICATION_TIMING
+    each one is wrapped in a TimedAuthenticator.
+    """
+    if policy is None:
+        classes = drf_settings.DEFAULT_AUTHENTICATION_CLASSES
+    else:
+        classes = [import_string(path) for path in settings.CHATS_AUTHENTICATION_POLICIES[policy]]
+    authenticators = [auth() for auth in classes]
+    if getattr(settings, 'CHATS_AUTHENTICATION_TIMING', False):
+        authenticators = [TimedAuthenticator(auth) for auth in authenticators]
+    return authenticators
+
+
+def server_timing(timings):
+    return ', '.join(f"auth-{name};dur={elapsed:.3f}" for name, elapsed in timings)
+
+
+class AuthenticationPolicyMixin:
+    """
+    Selects a view's authenticators by policy name instead of trying the
+    whole REST_FRAMEWORK chain. With CHATS_AUTHENTICATION_SERVER_TIMING it
+    also reports the time spent in each one in a Server-Timing response
+    header, which every caller can read, so it is meant for debugging.
+    """
+
+    authentication_policy = None
+
+    def get_authenticators(self):
+        return get_authenticators(self.authentication_policy)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        timings = getattr(request, 'authenticator_timings', None)
+        if timings and getattr(settings, 'CHATS_AUTHENTICATION_SERVER_TIMING', False):
+            response['Server-Timing'] = server_timing(timings)
+        return response
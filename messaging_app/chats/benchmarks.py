@@ -0,0 +1,81 @@
+# chats/benchmarks.py
+"""
+Helpers shared by the benchmark management commands.
+
+The commands seed their own data inside a transaction that is rolled back
+at the end, so they can be pointed at a development database safely.
+"""
+
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import User, Conversation, Message
+
+
+class Rollback(Exception):
+    """Raised to discard everything a benchmark wrote."""
+
+
+def seed_users(count, prefix='bench'):
+    tag = uuid.uuid4().hex[:8]
+    users = [
+        User(
+            username=f"{prefix}-{tag}-{i}",
+            email=f"{prefix}-{tag}-{i}@example.com",
+            first_name=prefix,
+            last_name=str(i),
+        )
+        for i in range(count)
+    ]
+    User.objects.bulk_create(users)
+    return users
+
+
+def seed_conversation(message_count, participants=2, batch_size=10000):
+    """
+    Create a conversation with `message_count` messages, one second apart,
+    alternating between the participants.
+    """
+    users = seed_users(participants)
+    conversation = Conversation.objects.create()
+    conversation.participants.set(users)
+
+    start = timezone.now() - timedelta(seconds=message_count)
+    for offset in range(0, message_count, batch_size):
+        Message.objects.bulk_create([
+            Message(
+                conversation=conversation,
+                sender=users[i % participants],
+                message_body=f"message {i}",
+                sent_at=start + timedelta(seconds=i),
+            )
+            for i in range(offset, min(offset + batch_size, message_count))
+        ], batch_size=batch_size)
+    return conversation, users
+
+
+def timed(func, repeat=5):
+    """Return the best wall time of `repeat` calls to `func`, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_and_rollback(func):
+    """Run `func` inside a transaction and roll everything back afterwards."""
+    result = None
+    try:
+        with transaction.atomic():
+            result = func()
+            raise Rollback
+    except Rollback:
+        pass
+    return result
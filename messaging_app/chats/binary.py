@@ -0,0 +1,208 @@
+# chats/binary.py
+"""
+MessagePack encoding for the compact binary wire format.
+
+UUIDs are sent as 16 raw bytes and datetimes as integer microseconds since
+the Unix epoch, UTC. Everything else maps onto MessagePack's own types.
+
+The msgpack package is used when it is installed. Otherwise a bundled
+codec covering the types the API produces (nil, booleans, integers,
+floats, str, bin, arrays and maps) writes the same bytes.
+"""
+
+import struct
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from django.utils.functional import Promise
+
+try:
+    import msgpack
+except ImportError:  # optional; the bundled codec below is used instead
+    msgpack = None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_native(obj):
+    """The MessagePack form of values it has no type for; the `default` hook."""
+    if isinstance(obj, uuid.UUID):
+        return obj.bytes
+    if isinstance(obj, datetime):
+        return (obj - EPOCH) // MICROSECOND
+    if isinstance(obj, Promise):
+        return str(obj)
+    raise TypeError(f"Cannot encode {type(obj).__name__} as MessagePack")
+
+
+def decode_timestamp(value):
+    """Inverse of encode_native() for datetimes."""
+    return EPOCH + value * MICROSECOND
+
+
+def _pack(obj, out, default):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -0x20 <= obj < 0:
+            out.append(obj & 0xff)
+        elif obj >= 0:
+            for code, fmt, limit in ((0xcc, '>B', 1 << 8), (0xcd, '>H', 1 << 16),
+                                     (0xce, '>I', 1 << 32), (0xcf, '>Q', 1 << 64)):
+                if obj < limit:
+                    out.append(code)
+                    out += struct.pack(fmt, obj)
+                    break
+            else:
+                raise OverflowError("Integer too large for MessagePack")
+        else:
+            for code, fmt, limit in ((0xd0, '>b', 1 << 7), (0xd1, '>h', 1 << 15),
+                                     (0xd2, '>i', 1 << 31), (0xd3, '>q', 1 << 63)):
+                if obj >= -limit:
+                    out.append(code)
+                    out += struct.pack(fmt, obj)
+                    break
+            else:
+                raise OverflowError("Integer too small for MessagePack")
+    elif isinstance(obj, float):
+        out.append(0xcb)
+        out += struct.pack('>d', obj)
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        size = len(data)
+        if size < 0x20:
+            out.append(0xa0 | size)
+        elif size < 1 << 8:
+            out += struct.pack('>BB', 0xd9, size)
+        elif size < 1 << 16:
+            out += struct.pack('>BH', 0xda, size)
+        else:
+            out += struct.pack('>BI', 0xdb, size)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        size = len(obj)
+        if size < 1 << 8:
+            out += struct.pack('>BB', 0xc4, size)
+        elif size < 1 << 16:
+            out += struct.pack('>BH', 0xc5, size)
+        else:
+            out += struct.pack('>BI', 0xc6, size)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _pack_header(out, len(obj), 0x90, 0xdc, 0xdd)
+        for item in obj:
+            _pack(item, out, default)
+    elif isinstance(obj, dict):
+        _pack_header(out, len(obj), 0x80, 0xde, 0xdf)
+        for key, value in obj.items():
+            _pack(key, out, default)
+            _pack(value, out, default)
+    else:
+        _pack(default(obj), out, default)
+
+
+def _pack_header(out, size, fix, code16, code32):
+    if size < 0x10:
+        out.append(fix | size)
+    elif size < 1 << 16:
+        out += struct.pack('>BH', code16, size)
+    else:
+        out += struct.pack('>BI', code32, size)
+
+
+# Fixed-width formats: type byte -> (struct format, size).
+_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# Length-prefixed formats: type byte -> (kind, struct format of the length, its size).
+_SIZED = {
+    0xc4: ('bin', '>B', 1), 0xc5: ('bin', '>H', 2), 0xc6: ('bin', '>I', 4),
+    0xd9: ('str', '>B', 1), 0xda: ('str', '>H', 2), 0xdb: ('str', '>I', 4),
+    0xdc: ('array', '>H', 2), 0xdd: ('array', '>I', 4),
+    0xde: ('map', '>H', 2), 0xdf: ('map', '>I', 4),
+}
+
+
+def _unpack(data, pos):
+    code = data[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if code <= 0x8f:
+        kind, size = 'map', code & 0x0f
+    elif code <= 0x9f:
+        kind, size = 'array', code & 0x0f
+    elif code <= 0xbf:
+        kind, size = 'str', code & 0x1f
+    elif code == 0xc0:
+        return None, pos
+    elif code == 0xc2:
+        return False, pos
+    elif code == 0xc3:
+        return True, pos
+    elif code in _FIXED:
+        fmt, width = _FIXED[code]
+        return struct.unpack_from(fmt, data, pos)[0], pos + width
+    elif code in _SIZED:
+        kind, fmt, width = _SIZED[code]
+        size = struct.unpack_from(fmt, data, pos)[0]
+        pos += width
+    else:
+        raise ValueError(f"Unsupported MessagePack type 0x{code:02x}")
+
+    if kind == 'str':
+        return bytes(data[pos:pos + size]).decode('utf-8'), pos + size
+    if kind == 'bin':
+        return bytes(data[pos:pos + size]), pos + size
+    if kind == 'array':
+        items = []
+        for _ in range(size):
+            item, pos = _unpack(data, pos)
+            items.append(item)
+        return items, pos
+    mapping = {}
+    for _ in range(size):
+        key, pos = _unpack(data, pos)
+        mapping[key], pos = _unpack(data, pos)
+    return mapping, pos
+
+
+def packb(obj):
+    if msgpack is not None:
+        return msgpack.packb(obj, default=encode_native, use_bin_type=True)
+    out = bytearray()
+    _pack(obj, out, encode_native)
+    return bytes(out)
+
+
+def unpack_stream(data):
+    """Yield each object of a concatenation of MessagePack objects, e.g. an export."""
+    if msgpack is not None:
+        unpacker = msgpack.Unpacker(raw=False, max_buffer_size=max(len(data), 1))
+        unpacker.feed(data)
+        yield from unpacker
+        return
+    view, pos = memoryview(data), 0
+    while pos < len(view):
+        obj, pos = _unpack(view, pos)
+        yield obj
+
+
+def unpackb(data):
+    if msgpack is not None:
+        return msgpack.unpackb(data, raw=False)
+    obj, pos = _unpack(memoryview(data), 0)
+    if pos != len(data):
+        raise ValueError("Extra data after the MessagePack object")
+    return obj
@@ -0,0 +1,53 @@
+# chats/conditional.py
+
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for list and retrieve.
+
+    Views implement get_conditional_state(), returning a (version, modified)
+    pair read from the summary tables, or None when there is nothing to
+    validate against. The ETag combines that version with the user, the
+    full URL and the negotiated media type, so the body never has to be
+    rendered to answer a conditional request with 304.
+    """
+
+    def get_conditional_state(self):
+        return None
+
+    def get_validators(self, request):
+        state = self.get_conditional_state()
+        if state is None:
+            return None, None
+        version, modified = state
+        key = '|'.join(str(part) for part in (
+            request.user.pk, request.get_full_path(), request.accepted_media_type, version,
+        ))
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        last_modified = int(modified.timestamp()) if modified else None
+        return etag, last_modified
+
+    def conditional(self, request, handler, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, super().retrieve, *args, **kwargs)
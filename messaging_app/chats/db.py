@@ -0,0 +1,43 @@
+# chats/db.py
+"""
+Database connection profile.
+
+Every new SQLite connection gets the CHATS_SQLITE_PRAGMAS. The default
+profile switches to WAL, so readers no longer block the writer and a commit
+is an append to the log instead of a rewrite of the rollback journal.
+synchronous=NORMAL drops the fsync per commit; only the last transactions
+before a power loss can be lost, and the database stays consistent.
+busy_timeout makes a writer wait for the lock rather than fail with
+"database is locked". Test runs (settings.TESTING) skip the pragmas, so
+the suite never switches a database file it happens to open to WAL.
+
+With CONN_MAX_AGE, connections outlive the request. Django 3.2 only closes
+them when they expire or after an error. With CHATS_CONN_HEALTH_CHECKS,
+connections being reused are also checked before each request, as
+CONN_HEALTH_CHECKS does in later Django versions.
+"""
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or getattr(settings, 'TESTING', False):
+        return
+    pragmas = getattr(settings, 'CHATS_SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(request_started)
+def check_connection_health(sender, **kwargs):
+    if not getattr(settings, 'CHATS_CONN_HEALTH_CHECKS', False):
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
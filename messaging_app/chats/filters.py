@@ -1,17 +1,23 @@
 # chats/filters.py
 
 import django_filters
-from .models import Message  # Adjust path as needed
-from django.contrib.auth import get_user_model
+from .models import Message
 
-User = get_user_model()
 
 class MessageFilter(django_filters.FilterSet):
-    sender = django_filters.ModelChoiceFilter(queryset=User.objects.all())
-    receiver = django_filters.ModelChoiceFilter(queryset=User.objects.all())
-    created_at = django_filters.DateFromToRangeFilter()
+    """
+    ?sender=<user id>, ?conversation=<conversation id> and
+    ?sent_at_after= / ?sent_at_before= (ISO 8601, inclusive).
+
+    Ids are only checked to be UUIDs, never looked up, so filtering costs no
+    extra queries; an unknown id simply matches nothing. The filters land
+    on the (conversation, sender, sent_at, message_id) and
+    (conversation, sent_at, message_id) indexes.
+    """
+    sender = django_filters.UUIDFilter(field_name='sender_id')
+    conversation = django_filters.UUIDFilter(field_name='conversation_id')
+    sent_at = django_filters.IsoDateTimeFromToRangeFilter()
 
     class Meta:
         model = Message
-        fields = ['sender', 'receiver', 'created_at']
-
+        fields = ['sender', 'conversation', 'sent_at']
@@ -0,0 +1,131 @@
+# chats/listcache.py
+"""
+Per-user cache of the first page of the conversation list.
+
+Entries live in the CHATS_CONVERSATION_LIST_CACHE cache for
+CHATS_CONVERSATION_LIST_CACHE_TIMEOUT seconds (0 disables the cache). Each
+key includes a per-user generation token. Invalidating a user's lists
+deletes that token, which orphans every cached variant of the page
+(page size, preview size, ordering, host) at once.
+
+Writers call invalidate_conversation() for the conversation they change;
+chats.summaries does so for message writes and chats.signals for
+participant and user changes. Lists are dropped inside the writer's
+transaction and again after commit, so a reader that refilled the cache
+from the pre-commit state is dropped too.
+"""
+
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .models import Conversation
+from .routers import reading_from_replica
+
+Participant = Conversation.participants.through
+
+
+class ListCacheStats:
+    """Hit, miss and invalidation counters for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def record(self, counter, count=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + count)
+
+    def snapshot(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
+
+
+stats = ListCacheStats()
+
+
+def get_list_cache():
+    return caches[getattr(settings, 'CHATS_CONVERSATION_LIST_CACHE', 'default')]
+
+
+def generation_key(user_id):
+    return f"chats:conversation-list-generation:{user_id}"
+
+
+def list_generation(cache, user_id):
+    key = generation_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not cache.add(key, generation, None):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def conversation_list_cache_key(cache, request):
+    user_id = request.user.pk
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"chats:conversation-list:{user_id}:{list_generation(cache, user_id)}:{url}"
+
+
+def drop_generations(user_ids):
+    get_list_cache().delete_many([generation_key(user_id) for user_id in user_ids])
+
+
+def invalidate_conversation_lists(user_ids):
+    """Drop the users' cached lists now and again once the transaction commits."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    drop_generations(user_ids)
+    stats.record('invalidations', len(user_ids))
+    transaction.on_commit(lambda: drop_generations(user_ids))
+
+
+def invalidate_conversation(conversation_id):
+    """Drop the cached lists of everyone taking part in the conversation."""
+    invalidate_conversation_lists(Participant.objects.filter(
+        conversation_id=conversation_id).values_list('user_id', flat=True))
+
+
+class CachedFirstPageMixin:
+    """
+    Serves the first page of list() from the conversation list cache. Goes
+    after ConditionalGetMixin, so a 304 is still answered without the cache.
+    Pages served from the read replica are not stored.
+    """
+
+    def is_list_cacheable(self, request):
+        return (
+            getattr(settings, 'CHATS_CONVERSATION_LIST_CACHE_TIMEOUT', 0) > 0
+            and request.method == 'GET'
+            and request.query_params.get(self.paginator.page_query_param, '1') == '1'
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_list_cacheable(request):
+            return super().list(request, *args, **kwargs)
+
+        cache = get_list_cache()
+        key = conversation_list_cache_key(cache, request)
+        data = cache.get(key)
+        if data is not None:
+            stats.record('hits')
+            return Response(data)
+
+        stats.record('misses')
+        response = super().list(request, *args, **kwargs)
+        # A page read from a lagging replica would outlive the invalidation
+        # that already ran on the primary.
+        if response.status_code == 200 and not reading_from_replica():
+            cache.set(key, response.data, settings.CHATS_CONVERSATION_LIST_CACHE_TIMEOUT)
+        return response
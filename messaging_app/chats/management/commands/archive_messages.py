@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chats.archive import archive_cutoff, archive_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than CHATS_ARCHIVE_AFTER_DAYS to the archive table, "
+        "in batches that commit one by one. Safe to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive after this many days instead.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches.")
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+        else:
+            cutoff = archive_cutoff()
+        if cutoff is None:
+            raise CommandError("Archiving is off: set CHATS_ARCHIVE_AFTER_DAYS or pass --days.")
+
+        total = 0
+        for moved in archive_messages(cutoff, options['batch_size'], options['max_batches']):
+            total += moved
+            self.stdout.write(f"Archived {total} messages")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total} messages sent before {cutoff.isoformat()}."))
@@ -0,0 +1,94 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chats.archive import archive_messages
+from chats.benchmarks import run_and_rollback, seed_users, timed
+from chats.models import ArchivedMessage, Conversation, Message
+from chats.pagination import MessageCursorPagination
+from chats.summaries import ensure_summary, rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Time history pages, conversation lists and message posts before and "
+        "after archiving the old part of the message table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=2000, help="Per conversation.")
+        parser.add_argument('--years', type=int, default=5, help="Messages are spread over this many years.")
+        parser.add_argument('--archive-after-days', type=int, default=365)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        run_and_rollback(lambda: self.run(options))
+
+    def seed(self, options):
+        rng = random.Random(0)
+        users = seed_users(2, prefix='bench-archive')
+        now = timezone.now()
+        span = timedelta(days=365 * options['years']).total_seconds()
+        conversations = []
+        started = time.perf_counter()
+        for _ in range(options['conversations']):
+            conversation = Conversation.objects.create()
+            conversation.participants.set(users)
+            Message.objects.bulk_create([
+                Message(
+                    conversation=conversation, sender=users[i % 2], message_body=f"message {i}",
+                    sent_at=now - timedelta(seconds=rng.uniform(0, span)),
+                )
+                for i in range(options['messages'])
+            ], batch_size=options['batch_size'])
+            ensure_summary(conversation)
+            conversations.append(conversation)
+        rebuild_summaries()
+        self.stdout.write(f"Seeded {Message.objects.count()} messages in {time.perf_counter() - started:.1f}s")
+        return users[0], conversations[0], now
+
+    def cold_page_link(self, conversation, depth):
+        """The `next` link a client holds after scrolling `depth` messages back."""
+        anchor = (
+            Message.objects.filter(conversation=conversation)
+            .order_by('-sent_at', '-message_id')[depth - 1]
+        )
+        paginator = MessageCursorPagination()
+        paginator.base_url = f"http://localhost/api/conversations/{conversation.pk}/messages/?skip_count=true"
+        paginator.page, paginator.has_next = [anchor], True
+        return paginator.get_next_link()
+
+    def measure(self, client, conversation, cold_link):
+        messages = f"/api/conversations/{conversation.pk}/messages/"
+        return {
+            'first page': timed(lambda: client.get(f"{messages}?skip_count=true")),
+            'first page + count': timed(lambda: client.get(messages)),
+            'cold page': timed(lambda: client.get(cold_link)),
+            'conversation list': timed(lambda: client.get('/api/conversations/?page=2&page_size=5')),
+            'post message': timed(lambda: client.post(messages, {'message_body': "hello"}, format='json')),
+        }
+
+    def run(self, options):
+        user, conversation, now = self.seed(options)
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+        cold_link = self.cold_page_link(conversation, int(options['messages'] * 0.9))
+
+        before = self.measure(client, conversation, cold_link)
+        started = time.perf_counter()
+        moved = sum(archive_messages(
+            now - timedelta(days=options['archive_after_days']), batch_size=options['batch_size']))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Archived {moved} messages in {elapsed:.1f}s ({moved / elapsed:.0f}/s), "
+            f"{Message.objects.count()} left hot, {ArchivedMessage.objects.count()} archived")
+        after = self.measure(client, conversation, cold_link)
+
+        self.stdout.write(f"{'request':>20} {'before ms':>10} {'after ms':>10}")
+        for label, ms in before.items():
+            self.stdout.write(f"{label:>20} {ms:>10.2f} {after[label]:>10.2f}")
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.benchmarks import seed_conversation
+from chats.summaries import ensure_summary
+from messaging_app.asgi import AsyncRoutesASGIHandler
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the chats API concurrently through the WSGI handler (one thread per "
+        "request, as a threaded server would), the plain ASGI handler, and the ASGI "
+        "handler with async views, and report requests/sec and latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument(
+            '--writes', type=float, default=0.1,
+            help="Fraction of requests that POST a message. SQLite serialises writers, "
+                 "so on the default database this measures lock waits as much as the views.",
+        )
+        parser.add_argument(
+            '--db-latency', type=float, default=2.0,
+            help="Milliseconds added to every query, standing in for a networked database.",
+        )
+
+    def handle(self, *args, **options):
+        # Requests are served from other threads and connections, so the
+        # data has to be committed; it is deleted again afterwards.
+        conversation, users = seed_conversation(options['messages'])
+        ensure_summary(conversation)
+        delay = options['db_latency'] / 1000
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def add_latency(connection, **kwargs):
+            connection.execute_wrappers.append(slow_query)
+
+        connection_created.connect(add_latency)
+        try:
+            self.run(conversation, users, options)
+        finally:
+            connection_created.disconnect(add_latency)
+            for connection in connections.all():
+                if slow_query in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(slow_query)
+            conversation.delete()
+            for user in users:
+                user.delete()
+
+    def run(self, conversation, users, options):
+        messages_url = f"/api/conversations/{conversation.pk}/messages/"
+        message = conversation.messages.latest('sent_at')
+        # Conversation retrieve embeds the whole history, which would drown
+        # out everything else; the message detail route stands in for it.
+        reads = [
+            ('GET', '/api/conversations/', b''),
+            ('GET', messages_url, b''),
+            ('GET', f"{messages_url}{message.pk}/", b''),
+        ]
+        write = ('POST', messages_url, json.dumps({'message_body': 'benchmark'}).encode())
+        every = round(1 / options['writes']) if options['writes'] else 0
+        calls = [
+            write if every and i % every == every - 1 else reads[i % len(reads)]
+            for i in range(options['requests'])
+        ]
+
+        self.stdout.write(
+            f"{options['requests']} requests, concurrency {options['concurrency']}, "
+            f"{sum(call is write for call in calls)} writes, {options['db_latency']} ms per query"
+        )
+        self.stdout.write(f"{'deployment':>12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for label, runner in (
+            ('wsgi', lambda authorization: self.run_wsgi(
+                WSGIHandler(), calls, authorization, options['concurrency'])),
+            ('asgi sync', lambda authorization: async_to_sync(self.run_asgi)(
+                ASGIHandler(), calls, authorization, options['concurrency'])),
+            ('asgi async', lambda authorization: async_to_sync(self.run_asgi)(
+                AsyncRoutesASGIHandler(), calls, authorization, options['concurrency'])),
+        ):
+            # A fresh token per run; slow runs can outlive the access token lifetime.
+            authorization = f"Bearer {AccessToken.for_user(users[0])}"
+            started = time.perf_counter()
+            results = runner(authorization)
+            elapsed = time.perf_counter() - started
+            self.report(label, results, elapsed)
+
+    def report(self, label, results, elapsed):
+        latencies = sorted(ms for _, ms in results)
+        errors = sum(status_code >= 400 for status_code, _ in results)
+        self.stdout.write(
+            f"{label:>12} {len(results) / elapsed:>8.0f} {statistics.median(latencies):>8.1f} "
+            f"{latencies[int(len(latencies) * 0.99) - 1]:>8.1f} {errors:>7}"
+        )
+
+    def run_wsgi(self, application, calls, authorization, concurrency):
+        factory = RequestFactory(SERVER_NAME='localhost')
+
+        def call(method, path, body):
+            environ = factory.generic(
+                method, path, body, content_type='application/json', HTTP_AUTHORIZATION=authorization,
+            ).environ
+            statuses = []
+            started = time.perf_counter()
+            response = application(environ, lambda status, headers: statuses.append(status))
+            b''.join(response)
+            response.close()
+            return int(statuses[0].split()[0]), (time.perf_counter() - started) * 1000
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(lambda args: call(*args), calls))
+
+    async def run_asgi(self, application, calls, authorization, concurrency):
+        slots = asyncio.Semaphore(concurrency)
+
+        async def call(method, path, body):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                'query_string': b'', 'root_path': '',
+                'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+                'headers': [
+                    (b'host', b'localhost'),
+                    (b'authorization', authorization.encode()),
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()),
+                ],
+            }
+            statuses = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(event):
+                if event['type'] == 'http.response.start':
+                    statuses.append(event['status'])
+
+            async with slots:
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                return statuses[0], (time.perf_counter() - started) * 1000
+
+        return await asyncio.gather(*(call(*args) for args in calls))
@@ -0,0 +1,47 @@
+import gzip
+import json
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from chats import binary
+from chats.benchmarks import run_and_rollback, seed_conversation, timed
+from chats.models import Message
+from chats.renderers import FastJSONRenderer
+from chats.serializers import MESSAGE_ROW_FIELDS, MessageSerializer, message_row_to_dict, message_row_to_native
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode time and size of the JSON and MessagePack message representations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        run_and_rollback(lambda: self.run(options))
+
+    def run(self, options):
+        conversation, _ = seed_conversation(options['messages'])
+        queryset = Message.objects.filter(conversation=conversation).order_by('-sent_at')
+        # Loaded once, so only serialization and encoding are timed.
+        messages = list(MessageSerializer.setup_eager_loading(queryset))
+        rows = list(queryset.values(*MESSAGE_ROW_FIELDS))
+
+        formats = (
+            ('json (MessageSerializer)',
+             lambda: JSONRenderer().render(MessageSerializer(messages, many=True).data), json.loads),
+            ('json (rows, orjson)',
+             lambda: FastJSONRenderer().render([message_row_to_dict(row) for row in rows]), json.loads),
+            ('msgpack (rows)',
+             lambda: binary.packb([message_row_to_native(row) for row in rows]), binary.unpackb),
+        )
+
+        codec = 'msgpack package' if binary.msgpack else 'bundled codec'
+        self.stdout.write(f"{options['messages']} messages, MessagePack via the {codec}")
+        self.stdout.write(f"{'format':>24} {'encode ms':>10} {'decode ms':>10} {'bytes':>9} {'gzip B':>9}")
+        for label, encode, decode in formats:
+            payload = encode()
+            encode_ms = timed(encode)
+            decode_ms = timed(lambda: decode(payload))
+            gzipped = len(gzip.compress(payload, compresslevel=6, mtime=0))
+            self.stdout.write(f"{label:>24} {encode_ms:>10.2f} {decode_ms:>10.2f} {len(payload):>9} {gzipped:>9}")
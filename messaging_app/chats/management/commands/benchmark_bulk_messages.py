@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from chats.benchmarks import run_and_rollback, seed_conversation
+from chats.summaries import ensure_summary
+
+
+class Command(BaseCommand):
+    help = "Compare messages/sec of the single-message and bulk message endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 500])
+
+    def handle(self, *args, **options):
+        run_and_rollback(lambda: self.run(options))
+
+    def run(self, options):
+        total = options['messages']
+        conversation, users = seed_conversation(0)
+        ensure_summary(conversation)
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(users[0])
+        url = f"/api/conversations/{conversation.pk}/messages/"
+
+        def rate(post, count):
+            started = time.perf_counter()
+            post()
+            return count / (time.perf_counter() - started)
+
+        def single():
+            for i in range(total):
+                client.post(url, {'message_body': f"single {i}"}, format='json')
+
+        self.stdout.write(f"{'mode':>12} {'msgs/sec':>12}")
+        self.stdout.write(f"{'single':>12} {rate(single, total):>12.0f}")
+
+        for batch_size in options['batch_sizes']:
+            batch = {'messages': [{'message_body': f"bulk {i}"} for i in range(batch_size)]}
+
+            def bulk():
+                for _ in range(max(1, total // batch_size)):
+                    client.post(url + 'bulk/', batch, format='json')
+
+            count = max(1, total // batch_size) * batch_size
+            self.stdout.write(f"{f'bulk x{batch_size}':>12} {rate(bulk, count):>12.0f}")
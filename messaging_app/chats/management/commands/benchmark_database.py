@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.test.utils import override_settings
+
+from chats.models import Conversation, Message, User
+
+ALIAS = 'benchmark'
+
+# (label, SQLite pragmas, keep connections between requests)
+PROFILES = (
+    ('stock, per request', {}, False),
+    ('stock, persistent', {}, True),
+    ('tuned, persistent', None, True),  # None: settings.CHATS_SQLITE_PRAGMAS
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure message creation and history reads under concurrency on a scratch "
+        "SQLite file, with and without persistent connections and the tuned pragmas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'profile':>20} {'writes/s':>9} {'reads/s':>9} {'locked':>7}")
+        for label, pragmas, persistent in PROFILES:
+            if pragmas is None:
+                pragmas = settings.CHATS_SQLITE_PRAGMAS
+            with tempfile.TemporaryDirectory() as directory, override_settings(CHATS_SQLITE_PRAGMAS=pragmas):
+                connections.databases[ALIAS] = {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': os.path.join(directory, 'benchmark.sqlite3'),
+                }
+                try:
+                    writes, reads, locked = self.run(options, persistent)
+                finally:
+                    connections[ALIAS].close()
+                    del connections[ALIAS]
+                    del connections.databases[ALIAS]
+            seconds = options['seconds']
+            self.stdout.write(f"{label:>20} {writes / seconds:>9.0f} {reads / seconds:>9.0f} {locked:>7}")
+
+    def run(self, options, persistent):
+        call_command('migrate', database=ALIAS, verbosity=0)
+        users = User.objects.using(ALIAS).bulk_create([
+            User(username=f"bench-db-{i}", email=f"bench-db-{i}@example.com") for i in range(2)
+        ])
+        conversation = Conversation.objects.using(ALIAS).create()
+        # Bypasses the m2m signal, whose summary writes go to the default database.
+        Participant = Conversation.participants.through
+        Participant.objects.using(ALIAS).bulk_create([
+            Participant(conversation_id=conversation.pk, user_id=user.pk) for user in users
+        ])
+        connections[ALIAS].close()
+
+        counts = {'writes': 0, 'reads': 0, 'locked': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+
+        def request(kind, work):
+            try:
+                work()
+                counter = kind
+            except OperationalError:
+                counter = 'locked'
+            finally:
+                if not persistent:
+                    connections[ALIAS].close()
+            with lock:
+                counts[counter] += 1
+
+        def write():
+            Message.objects.using(ALIAS).create(
+                conversation_id=conversation.pk, sender_id=users[0].pk, message_body='benchmark')
+
+        def read():
+            list(Message.objects.using(ALIAS).filter(conversation_id=conversation.pk)
+                 .order_by('-sent_at', '-message_id').values('message_id', 'message_body', 'sent_at')[:20])
+
+        def worker(kind, work):
+            while time.perf_counter() < deadline:
+                request(kind, work)
+            connections[ALIAS].close()
+
+        threads = [threading.Thread(target=worker, args=('writes', write)) for _ in range(options['writers'])]
+        threads += [threading.Thread(target=worker, args=('reads', read)) for _ in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts['writes'], counts['reads'], counts['locked']
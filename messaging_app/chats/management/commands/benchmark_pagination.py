@@ -0,0 +1,57 @@
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from chats.benchmarks import run_and_rollback, seed_conversation, timed
+from chats.models import Message
+from chats.pagination import CustomMessagePagination, MessageCursorPagination
+
+
+class Command(BaseCommand):
+    help = "Compare page-N latency of offset and keyset pagination on one long conversation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 40000])
+
+    def handle(self, *args, **options):
+        run_and_rollback(lambda: self.run(options))
+
+    def run(self, options):
+        page_size = options['page_size']
+        self.stdout.write(f"Seeding {options['messages']} messages...")
+        conversation, _ = seed_conversation(options['messages'])
+        queryset = Message.objects.filter(conversation=conversation).order_by('-sent_at')
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+
+        def paginate(paginator, params):
+            request = Request(factory.get('/messages/', params))
+            return paginator.paginate_queryset(queryset, request)
+
+        self.stdout.write(f"{'page':>8} {'offset ms':>12} {'cursor ms':>12} {'cursor+count ms':>16}")
+        for page in options['pages']:
+            depth = (page - 1) * page_size
+            if depth >= options['messages']:
+                continue
+
+            # Build the cursor that points just before row `depth`, the same
+            # position a client reaches after following `next` page-1 times.
+            params = {'page_size': page_size, 'skip_count': 'true'}
+            if depth:
+                anchor = queryset.order_by('-sent_at', '-message_id')[depth - 1]
+                cursor_paginator = MessageCursorPagination()
+                cursor_paginator.base_url = 'http://localhost/messages/'
+                cursor_paginator.page = [anchor]
+                cursor_paginator.has_next = True
+                link = cursor_paginator.get_next_link()
+                params['cursor'] = parse_qs(urlparse(link).query)['cursor'][0]
+
+            offset_ms = timed(lambda: paginate(
+                CustomMessagePagination(), {'page': page, 'page_size': page_size}))
+            cursor_ms = timed(lambda: paginate(MessageCursorPagination(), params))
+            counted = dict(params, skip_count='false')
+            counted_ms = timed(lambda: paginate(MessageCursorPagination(), counted))
+            self.stdout.write(f"{page:>8} {offset_ms:>12.2f} {cursor_ms:>12.2f} {counted_ms:>16.2f}")
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import statistics
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.benchmarks import run_and_rollback, seed_conversation
+from chats.realtime import publish_messages
+from chats.websocket import websocket_application
+
+
+class Command(BaseCommand):
+    help = (
+        "Open many WebSocket connections to one conversation through the ASGI app "
+        "and measure how long published messages take to reach every socket."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=5000)
+        parser.add_argument('--messages', type=int, default=20)
+
+    def handle(self, *args, **options):
+        run_and_rollback(lambda: self.run(options))
+
+    def run(self, options):
+        conversation, users = seed_conversation(0, participants=2)
+        query_string = f"token={AccessToken.for_user(users[1])}".encode()
+        async_to_sync(self.load)(conversation.pk, query_string, options)
+
+    async def load(self, conversation_id, query_string, options):
+        scope = {
+            'type': 'websocket', 'path': f"/ws/conversations/{conversation_id}/",
+            'query_string': query_string, 'headers': [],
+        }
+        latencies = []
+        accepted = 0
+        expected = options['connections'] * options['messages']
+        all_delivered = asyncio.Event()
+        sockets = []
+
+        def make_socket():
+            inbox = asyncio.Queue()
+            connected = asyncio.Event()
+
+            async def send(event):
+                nonlocal accepted
+                if event['type'] == 'websocket.accept':
+                    accepted += 1
+                    connected.set()
+                elif event['type'] == 'websocket.send':
+                    sent = json.loads(event['text'])['message']['sent']
+                    latencies.append(time.perf_counter() - sent)
+                    if len(latencies) == expected:
+                        all_delivered.set()
+                else:
+                    connected.set()
+
+            task = asyncio.ensure_future(websocket_application(scope, inbox.get, send))
+            return inbox, connected, task
+
+        started = time.perf_counter()
+        for _ in range(options['connections']):
+            inbox, connected, task = make_socket()
+            await inbox.put({'type': 'websocket.connect'})
+            sockets.append((inbox, connected, task))
+        await asyncio.gather(*(connected.wait() for _, connected, _ in sockets))
+        connect_s = time.perf_counter() - started
+        self.stdout.write(f"{accepted} sockets connected in {connect_s:.2f}s")
+
+        for i in range(options['messages']):
+            # Publish from a worker thread, as MessageViewSet.create does.
+            await sync_to_async(publish_messages, thread_sensitive=False)(
+                conversation_id, [{'body': f"message {i}", 'sent': time.perf_counter()}])
+            await asyncio.sleep(0)
+        await asyncio.wait_for(all_delivered.wait(), 120)
+
+        for inbox, _, _ in sockets:
+            await inbox.put({'type': 'websocket.disconnect'})
+        await asyncio.gather(*(task for _, _, task in sockets))
+
+        latencies.sort()
+        ms = [value * 1000 for value in latencies]
+        self.stdout.write(
+            f"{len(ms)} deliveries: p50 {statistics.median(ms):.2f} ms, "
+            f"p99 {ms[int(len(ms) * 0.99) - 1]:.2f} ms, max {ms[-1]:.2f} ms"
+        )
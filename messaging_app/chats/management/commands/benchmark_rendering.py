@@ -0,0 +1,67 @@
+import gzip
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from chats.benchmarks import run_and_rollback, seed_conversation, seed_users, timed
+from chats.models import Conversation
+from chats.renderers import FastJSONRenderer
+from chats.views import ConversationViewSet, MessageViewSet
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = "Compare JSONRenderer with FastJSONRenderer, and response sizes raw, gzipped and brotli'd."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--conversations', type=int, default=100)
+        parser.add_argument('--level', type=int, default=6, help="gzip level (brotli quality is scaled from it).")
+
+    def handle(self, *args, **options):
+        run_and_rollback(lambda: self.run(options))
+
+    def response_data(self, view, url, user, **kwargs):
+        request = APIRequestFactory(SERVER_NAME='localhost').get(url)
+        force_authenticate(request, user)
+        response = view(request, **kwargs)
+        assert response.status_code == 200, response.status_code
+        return response.data
+
+    def run(self, options):
+        conversation, users = seed_conversation(options['messages'])
+        for _ in range(options['conversations']):
+            extra = Conversation.objects.create()
+            extra.participants.set([users[0], *seed_users(2, prefix='bench-render')])
+
+        messages = MessageViewSet.as_view({'get': 'list'})
+        conversations = ConversationViewSet.as_view({'get': 'list'})
+        detail = ConversationViewSet.as_view({'get': 'retrieve'})
+        payloads = (
+            ('message page / 100', self.response_data(
+                messages, '/?page_size=100', users[0], conversation_pk=conversation.pk)),
+            ('conversation list', self.response_data(conversations, '/?page_size=100', users[0])),
+            ('conversation detail', self.response_data(detail, '/', users[0], pk=conversation.pk)),
+        )
+
+        level = options['level']
+        quality = min(11, round(level * 11 / 9))
+        self.stdout.write(
+            f"{'payload':>20} {'json ms':>9} {'orjson ms':>10} {'speedup':>8}"
+            f" {'raw B':>9} {'gzip B':>9} {'br B':>9}"
+        )
+        for label, data in payloads:
+            json_ms = timed(lambda: JSONRenderer().render(data))
+            fast_ms = timed(lambda: FastJSONRenderer().render(data))
+            raw = FastJSONRenderer().render(data)
+            gzipped = len(gzip.compress(raw, compresslevel=level, mtime=0))
+            brotlied = len(brotli.compress(raw, quality=quality)) if brotli else '-'
+            self.stdout.write(
+                f"{label:>20} {json_ms:>9.2f} {fast_ms:>10.2f} {json_ms / fast_ms:>7.1f}x"
+                f" {len(raw):>9} {gzipped:>9} {brotlied:>9}"
+            )
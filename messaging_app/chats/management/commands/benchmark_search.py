@@ -0,0 +1,73 @@
+import random
+import string
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chats.benchmarks import run_and_rollback, seed_users, timed
+from chats.models import Conversation, Message
+from chats.search import like_search, search_available, search_messages
+
+_rng = random.Random(0)
+# Random words, so prefix matches on the last query word stay rare.
+WORDS = [''.join(_rng.choices(string.ascii_lowercase, k=7)) for _ in range(5000)]
+
+
+class Command(BaseCommand):
+    help = "Compare the FTS5 message search with the LIKE scan SearchFilter would run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--conversations', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if not search_available():
+            raise CommandError("Message search is only available on SQLite.")
+        run_and_rollback(lambda: self.run(options))
+
+    def seed(self, options):
+        """
+        Messages spread over `conversations` conversations, the searching user
+        taking part in one in ten. Bodies are 12 words drawn with a Zipf-like
+        skew, so the first WORDS are common and the last ones rare.
+        """
+        rng = random.Random(0)
+        users = seed_users(100, prefix='bench-search')
+        conversations = []
+        for i in range(options['conversations']):
+            conversation = Conversation.objects.create()
+            pair = [users[0], rng.choice(users[1:])] if i % 10 == 0 else rng.sample(users[1:], 2)
+            conversation.participants.set(pair)
+            conversations.append((conversation, pair))
+
+        weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+        start = timezone.now() - timedelta(seconds=options['messages'])
+        started = time.perf_counter()
+        for offset in range(0, options['messages'], options['batch_size']):
+            batch = []
+            for i in range(offset, min(offset + options['batch_size'], options['messages'])):
+                conversation, pair = conversations[i % len(conversations)]
+                batch.append(Message(
+                    conversation=conversation,
+                    sender=pair[i % 2],
+                    message_body=' '.join(rng.choices(WORDS, weights, k=12)),
+                    sent_at=start + timedelta(seconds=i),
+                ))
+            Message.objects.bulk_create(batch)
+        self.stdout.write(f"Seeded {options['messages']} messages in {time.perf_counter() - started:.1f}s")
+        return users[0]
+
+    def run(self, options):
+        user = self.seed(options)
+        self.stdout.write(f"{'query':>14} {'like ms':>10} {'fts ms':>10} {'speedup':>8}")
+        queries = (
+            ('common', WORDS[0]), ('frequent', WORDS[50]), ('rare', WORDS[-1]),
+            ('two words', f"{WORDS[0]} {WORDS[50]}"), ('prefix', WORDS[1000][:4]),
+        )
+        for label, query in queries:
+            like_ms = timed(lambda: like_search(user, query, 20), repeat=3)
+            fts_ms = timed(lambda: search_messages(user, query, 20), repeat=3)
+            self.stdout.write(f"{label:>14} {like_ms:>10.1f} {fts_ms:>10.1f} {like_ms / fts_ms:>7.1f}x")
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from chats.benchmarks import run_and_rollback, seed_conversation, seed_users, timed
+from chats.models import Conversation, Message
+from chats.serializers import (
+    ConversationListSerializer, ConversationRowSerializer, MessageRowSerializer, MessageSerializer,
+)
+
+
+class Command(BaseCommand):
+    help = "Compare list rendering time of the model serializers and the .values() fast path."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--conversations', type=int, default=100)
+
+    def handle(self, *args, **options):
+        run_and_rollback(lambda: self.run(options))
+
+    def render(self, serializer_class, queryset, context=None):
+        queryset = serializer_class.setup_eager_loading(queryset)
+        return serializer_class(queryset, many=True, context=context or {}).data
+
+    def run(self, options):
+        conversation, users = seed_conversation(options['messages'])
+        messages = Message.objects.filter(conversation=conversation).order_by('-sent_at')
+
+        others = seed_users(3, prefix='bench-conv')
+        for _ in range(options['conversations']):
+            extra = Conversation.objects.create()
+            extra.participants.set(others)
+        conversations = (
+            Conversation.objects.filter(participants=others[0])
+            .annotate(message_count=Count('messages')).order_by('-created_at')
+        )
+        request = Request(APIRequestFactory(SERVER_NAME='localhost').get('/'))
+
+        per_1k = 1000 / options['messages']
+        self.stdout.write(f"{'list':>20} {'model ms':>10} {'fast ms':>10} {'speedup':>8}")
+        for label, model, fast, queryset, scale in (
+            ('messages / 1k', MessageSerializer, MessageRowSerializer, messages, per_1k),
+            (f"conversations / {options['conversations']}",
+             ConversationListSerializer, ConversationRowSerializer, conversations, 1),
+        ):
+            model_ms = timed(lambda: self.render(model, queryset, {'request': request})) * scale
+            fast_ms = timed(lambda: self.render(fast, queryset, {'request': request})) * scale
+            self.stdout.write(f"{label:>20} {model_ms:>10.2f} {fast_ms:>10.2f} {model_ms / fast_ms:>7.1f}x")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chats.models import ConversationSummary, ParticipantSummary
+from chats.summaries import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the conversation summary tables from existing messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_summaries(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {ConversationSummary.objects.count()} conversation summaries "
+            f"and {ParticipantSummary.objects.count()} participant summaries."
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.search import rebuild_search_index, search_available
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text message search index, e.g. after a VACUUM."
+
+    def handle(self, *args, **options):
+        if not search_available():
+            raise CommandError("Message search is only available on SQLite.")
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the message search index."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from chats.routers import get_replica, replicate_sqlite
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over the read replica, standing in "
+        "for replication in local setups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', help="Replica alias (default: CHATS_READ_REPLICA).")
+
+    def handle(self, *args, **options):
+        alias = options['replica'] or get_replica()
+        if not alias:
+            raise CommandError("No replica: set CHATS_READ_REPLICA or pass --replica.")
+        source, target = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+            raise CommandError("replicate only copies SQLite databases.")
+        replicate_sqlite(source, target)
+        self.stdout.write(self.style.SUCCESS(f"Copied {DEFAULT_DB_ALIAS} to {alias}."))
@@ -0,0 +1,167 @@
+# chats/middleware.py
+
+import asyncio
+import gzip
+import re
+import time
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional; without it only gzip is offered
+    brotli = None
+
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/(json|x-ndjson|x-msgpack|javascript|xml)|[^;]*\+json)')
+
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header."""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def choose_encoding(header, available):
+    """The acceptable coding from `available` (in order of preference) with the highest q."""
+    codings = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = codings.get(coding, codings.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def flush_points(chunks, flush_size, flush_interval):
+    """
+    (chunk, flush) pairs for a streamed body. A flush is due once
+    `flush_size` bytes or `flush_interval` seconds have gone by since the
+    last one. Flushing less often keeps most of the compression, while
+    slow streams still reach the client promptly.
+    """
+    pending, flushed_at = 0, time.monotonic()
+    for chunk in chunks:
+        pending += len(chunk)
+        flush = pending >= flush_size or time.monotonic() - flushed_at >= flush_interval
+        if flush:
+            pending, flushed_at = 0, time.monotonic()
+        yield chunk, flush
+
+
+def gzip_stream(chunks, level, flush_size, flush_interval):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk, flush in flush_points(chunks, flush_size, flush_interval):
+        data = compressor.compress(chunk)
+        if flush:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def brotli_stream(chunks, quality, flush_size, flush_interval):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk, flush in flush_points(chunks, flush_size, flush_interval):
+        data = compressor.process(chunk)
+        if flush:
+            data += compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Negotiated response compression: brotli (when installed) or gzip,
+    picked from Accept-Encoding by q-value.
+
+    Unlike django.middleware.gzip.GZipMiddleware, it only compresses text and
+    JSON bodies of at least CHATS_COMPRESSION_MIN_SIZE bytes, and at
+    CHATS_COMPRESSION_LEVEL (gzip 1-9, brotli quality 0-11 scaled from it)
+    rather than the slowest setting. Streaming responses are always
+    compressed, and flushed every CHATS_COMPRESSION_FLUSH_SIZE bytes or
+    CHATS_COMPRESSION_FLUSH_INTERVAL seconds, whichever comes first.
+
+    It is async capable, so async views (the long poll, the ASGI API views)
+    are not pushed back onto a thread by a sync middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'CHATS_COMPRESSION_MIN_SIZE', 1024)
+        self.level = getattr(settings, 'CHATS_COMPRESSION_LEVEL', 6)
+        self.flush_size = getattr(settings, 'CHATS_COMPRESSION_FLUSH_SIZE', 64 * 1024)
+        self.flush_interval = getattr(settings, 'CHATS_COMPRESSION_FLUSH_INTERVAL', 1.0)
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        if asyncio.iscoroutinefunction(get_response):
+            # How Django 3.2 marks an instance as a coroutine function.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(encoding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed = self.compress(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The body differs per encoding, so a strong validator would lie.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def brotli_quality(self):
+        return min(11, round(self.level * 11 / 9))
+
+    def compress(self, encoding, content):
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality())
+        return gzip.compress(content, compresslevel=self.level, mtime=0)
+
+    def compress_stream(self, encoding, chunks):
+        if encoding == 'br':
+            return brotli_stream(chunks, self.brotli_quality(), self.flush_size, self.flush_interval)
+        return gzip_stream(chunks, self.level, self.flush_size, self.flush_interval)
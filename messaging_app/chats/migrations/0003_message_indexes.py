@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_conversationsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at', 'message_id'], name='message_conv_sent_idx'),
+        ),
+        # The participants through table is created implicitly, so its
+        # covering (user_id, conversation_id) index is added by hand.
+        migrations.RunSQL(
+            sql='CREATE INDEX "participants_user_conv_idx" '
+                'ON "chats_conversation_participants" ("user_id", "conversation_id");',
+            reverse_sql='DROP INDEX "participants_user_conv_idx";',
+        ),
+    ]
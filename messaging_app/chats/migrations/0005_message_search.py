@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# An external-content FTS5 index over chats_message, keyed by the message's
+# rowid (see chats.search). conversation_id is indexed too, so searches are
+# scoped inside the index. The triggers keep it in step with every write,
+# including bulk_create, queryset deletes and cascades.
+FORWARD = [
+    "CREATE VIRTUAL TABLE chats_message_fts USING fts5("
+    "message_body, conversation_id, content='chats_message', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER chats_message_fts_insert AFTER INSERT ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts (rowid, message_body, conversation_id) "
+    "VALUES (new.rowid, new.message_body, new.conversation_id); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_delete AFTER DELETE ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts (chats_message_fts, rowid, message_body, conversation_id) "
+    "VALUES ('delete', old.rowid, old.message_body, old.conversation_id); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_update AFTER UPDATE OF message_body, conversation_id ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts (chats_message_fts, rowid, message_body, conversation_id) "
+    "VALUES ('delete', old.rowid, old.message_body, old.conversation_id); "
+    "INSERT INTO chats_message_fts (rowid, message_body, conversation_id) "
+    "VALUES (new.rowid, new.message_body, new.conversation_id); "
+    "END",
+    "INSERT INTO chats_message_fts (chats_message_fts) VALUES ('rebuild')",
+]
+
+BACKWARD = [
+    "DROP TRIGGER chats_message_fts_update",
+    "DROP TRIGGER chats_message_fts_delete",
+    "DROP TRIGGER chats_message_fts_insert",
+    "DROP TABLE chats_message_fts",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is SQLite only; other databases go without the search index.
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_conversationsummary_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD), run(BACKWARD)),
+    ]
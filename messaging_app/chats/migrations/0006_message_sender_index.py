@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_message_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sender', 'sent_at', 'message_id'], name='message_conv_sender_sent_idx'),
+        ),
+    ]
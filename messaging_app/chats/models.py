@@ -40,5 +40,67 @@ class Message(models.Model):
     message_body = models.TextField(null=False)
     sent_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # Serves the conversation history: filter by conversation,
+            # ordered by (sent_at, message_id) for keyset pagination.
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='message_conv_sent_idx'),
+            # The same history narrowed to one sender (chats.filters.MessageFilter).
+            models.Index(fields=['conversation', 'sender', 'sent_at', 'message_id'], name='message_conv_sender_sent_idx'),
+            # Oldest first across conversations, for chats.archive.
+            models.Index(fields=['sent_at', 'message_id'], name='message_sent_idx'),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender.username} at {self.sent_at}"
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of Message by chats.archive, with the same id,
+    sender, body and timestamp. Archived messages are read-only.
+    """
+    message_id = models.UUIDField(primary_key=True, editable=False)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_messages')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archived_messages')
+    message_body = models.TextField(null=False)
+    sent_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='archive_conv_sent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message from {self.sender.username} at {self.sent_at}"
+
+
+class ConversationSummary(models.Model):
+    """
+    Denormalised activity of a conversation, kept up to date as messages are
+    written so inbox listings never have to aggregate over Message.
+    """
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_sent_at = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    # Bumped on every change to the conversation's messages or participants.
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Summary of {self.conversation_id}"
+
+
+class ParticipantSummary(models.Model):
+    """Per-participant read state of a conversation."""
+    summary = models.ForeignKey(ConversationSummary, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_summaries')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('summary', 'user')
+
+    def __str__(self):
+        return f"{self.user_id} in {self.summary_id}: {self.unread_count} unread"
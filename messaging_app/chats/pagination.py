@@ -1,6 +1,13 @@
 # chats/pagination.py
 
-from rest_framework.pagination import PageNumberPagination
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import lru_cache
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
 class CustomMessagePagination(PageNumberPagination):
@@ -16,3 +23,127 @@ class CustomMessagePagination(PageNumberPagination):
             'results': data
         })
 
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (sent_at, message_id), newest first.
+
+    Pages are fetched with a range predicate on the composite key instead of
+    an OFFSET, so page N costs the same as page 1. The cursors are opaque to
+    clients. Pass ?skip_count=true to leave out the COUNT(*) query.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-sent_at', '-message_id')
+    skip_count_query_param = 'skip_count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        # Archived messages (chats.archive) all sort before the hot ones, so
+        # the archive is only built and read once the hot rows run out.
+        sources = [lambda: queryset]
+        if hasattr(view, 'get_archive_queryset'):
+            sources.append(lru_cache()(view.get_archive_queryset))
+
+        self.count = None if self.skip_count(request) else sum(source().count() for source in sources)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        if reverse:
+            sources.reverse()
+
+        # Fetch one extra row to find out whether there is a further page.
+        results = []
+        for source in sources:
+            if len(results) > self.page_size:
+                break
+            results += list(self.seek(source())[:self.page_size + 1 - len(results)])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def seek(self, queryset):
+        """`queryset` from the current cursor on, in page order."""
+        if self.cursor is None:
+            return queryset.order_by('-sent_at', '-message_id')
+        sent_at, message_id = self.decode_position(self.cursor.position)
+        # The redundant sent_at bound gives the database a range to seek
+        # to; the OR alone would be evaluated row by row from the top.
+        if self.cursor.reverse:
+            return queryset.filter(
+                Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id),
+                sent_at__gte=sent_at,
+            ).order_by('sent_at', 'message_id')
+        return queryset.filter(
+            Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, message_id__lt=message_id),
+            sent_at__lte=sent_at,
+        ).order_by('-sent_at', '-message_id')
+
+    def skip_count(self, request):
+        value = request.query_params.get(self.skip_count_query_param, '')
+        return value.lower() in ('1', 'true', 'yes')
+
+    def encode_position(self, instance):
+        if isinstance(instance, dict):
+            return f"{instance['sent_at'].isoformat()}|{instance['message_id']}"
+        return f"{instance.sent_at.isoformat()}|{instance.message_id}"
+
+    def decode_position(self, position):
+        try:
+            sent_at, message_id = position.split('|')
+            sent_at = parse_datetime(sent_at)
+            message_id = uuid.UUID(message_id)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if sent_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return sent_at, message_id
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self.encode_position(self.page[-1])
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self.encode_position(self.page[0])
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+
+
+def encode_message_cursor(message):
+    """Opaque token for the position of `message` (a Message or .values() row)."""
+    position = MessageCursorPagination().encode_position(message)
+    return urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_message_cursor(cursor):
+    """Return (sent_at, message_id) from encode_message_cursor's output."""
+    try:
+        position = urlsafe_b64decode(cursor.encode()).decode()
+    except (ValueError, UnicodeError):
+        raise NotFound(MessageCursorPagination.invalid_cursor_message)
+    return MessageCursorPagination().decode_position(position)
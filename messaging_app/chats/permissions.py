@@ -1,7 +1,46 @@
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import permissions
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 from .models import Conversation
 
+
+def participation_cache_key(conversation_id, user_id):
+    return f"chats:participant:{conversation_id}:{user_id}"
+
+
+def is_participant(request, conversation_id):
+    """
+    Whether the requesting user takes part in the conversation.
+
+    Answered by a single EXISTS query, memoised on the request so the
+    permission class and the view share one lookup. When
+    CHATS_PARTICIPATION_CACHE_TIMEOUT is set the answer is also kept in the
+    shared cache; chats.signals drops it when the participants change.
+    """
+    conversation_id = Conversation._meta.pk.to_python(conversation_id)
+    user_id = request.user.pk
+    memo = getattr(request, '_participation', None)
+    if memo is None:
+        memo = request._participation = {}
+
+    key = participation_cache_key(conversation_id, user_id)
+    if key in memo:
+        return memo[key]
+
+    timeout = getattr(settings, 'CHATS_PARTICIPATION_CACHE_TIMEOUT', 0)
+    result = cache.get(key) if timeout else None
+    if result is None:
+        result = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id, user_id=user_id,
+        ).exists()
+        if timeout:
+            cache.set(key, result, timeout)
+
+    memo[key] = result
+    return result
+
+
 class IsOwner(permissions.BasePermission):
     """
     Allows access only to objects owned by the requesting user.
@@ -21,15 +60,15 @@ class IsParticipantOfConversation(BasePermission):
         return request.user and request.user.is_authenticated
 
     def has_object_permission(self, request, view, obj):
-        # Get the related conversation
-        conversation = getattr(obj, 'conversation', obj)
+        # Get the related conversation without loading it
+        conversation_id = getattr(obj, 'conversation_id', None) or obj.pk
 
         # Check if user is a participant
-        is_participant = request.user in conversation.participants.all()
+        participant = is_participant(request, conversation_id)
 
         # Explicitly handle unsafe methods
         if request.method in ["PUT", "PATCH", "DELETE"]:
-            return is_participant
+            return participant
 
         # Allow other methods (e.g., GET, POST) only if user is a participant
-        return is_participant
+        return participant
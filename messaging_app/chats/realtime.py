@@ -0,0 +1,114 @@
+# chats/realtime.py
+"""
+Fan-out of new messages to WebSocket subscribers.
+
+The broker is chosen by CHATS_REALTIME_BACKEND. The default InProcessBroker
+only reaches sockets served by the same process; a shared backend (or a
+local stand-in for one in tests) just has to implement BaseBroker.
+"""
+
+import asyncio
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'chats.realtime.InProcessBroker'
+
+
+class Subscription:
+    """One socket's view of a channel: an asyncio queue fed from any thread."""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, message):
+        # Publishers usually run in a worker thread, never on our loop.
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class BaseBroker:
+
+    def subscribe(self, channel):
+        """Return a Subscription; must be called from the subscriber's event loop."""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        """Deliver `message` to every current subscriber of `channel`. Thread safe."""
+        raise NotImplementedError
+
+
+class InProcessBroker(BaseBroker):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'CHATS_REALTIME_BACKEND', DEFAULT_BACKEND))()
+        return _broker
+
+
+def reset_broker():
+    """Forget the current broker, e.g. after changing CHATS_REALTIME_BACKEND."""
+    global _broker
+    with _broker_lock:
+        _broker = None
+
+
+def conversation_channel(conversation_id):
+    return f"conversation:{uuid.UUID(str(conversation_id)).hex}"
+
+
+def publish_messages(conversation_id, messages):
+    """Push already-serialised messages to the conversation's subscribers."""
+    broker = get_broker()
+    channel = conversation_channel(conversation_id)
+    for message in messages:
+        broker.publish(channel, {'type': 'message', 'message': message})
@@ -0,0 +1,51 @@
+# chats/renderers.py
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .binary import packb
+
+try:
+    import orjson
+except ImportError:  # optional; FastJSONRenderer then behaves like JSONRenderer
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson when it is installed.
+
+    Output matches JSONRenderer's compact UTF-8 form, including 'Z' for UTC
+    datetimes and escaped U+2028/U+2029. Values orjson does not know natively
+    (Decimal, lazy strings, ...) go through the encoder_class. Indented or
+    ASCII-only output, as the browsable API or UNICODE_JSON = False ask for,
+    is left to JSONRenderer.
+    """
+
+    options = orjson.OPT_UTC_Z if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        rendered = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        # Like JSONRenderer, keep the output safe to embed in JavaScript.
+        return rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    The compact binary format (see chats.binary): UUIDs as 16 raw bytes and
+    datetimes as integer microseconds, so serializers feeding it should
+    leave those values unconverted.
+    """
+
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(data)
@@ -0,0 +1,143 @@
+# chats/routers.py
+"""
+Read replica routing.
+
+When CHATS_READ_REPLICA names a database alias, list and retrieve requests
+on the conversation and message APIs (ReplicaReadMixin) read the chats
+models from it. Writes, and reads outside those requests, stay on the
+default database.
+
+Replicas lag behind the primary. After a successful write, the user is
+pinned to the primary for CHATS_READ_YOUR_WRITES_WINDOW seconds, so the
+conversation they just created or the message they just posted shows up
+in their next list. Other users see it once the replica has caught up.
+Pins live in the default cache, so use a shared cache when there is more
+than one process.
+
+Locally the replica is a second SQLite file, brought up to date with
+`manage.py replicate` (replicate_sqlite()) in place of real replication.
+"""
+
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+_replica_reads = ContextVar('chats_replica_reads', default=False)
+
+
+def get_replica():
+    return getattr(settings, 'CHATS_READ_REPLICA', None)
+
+
+def reading_from_replica():
+    return _replica_reads.get() and bool(get_replica())
+
+
+@contextmanager
+def replica_reads():
+    """Send reads of the chats models to the replica inside the block."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def primary_pin_key(user):
+    return f'chats:primary-pin:{user.pk}'
+
+
+def pin_to_primary(user):
+    window = getattr(settings, 'CHATS_READ_YOUR_WRITES_WINDOW', 0)
+    if window > 0:
+        cache.set(primary_pin_key(user), True, window)
+
+
+def is_pinned_to_primary(user):
+    return cache.get(primary_pin_key(user), False)
+
+
+class ReplicaRouter:
+    """Routes reads of the chats models to the replica inside replica_reads()."""
+    app_label = 'chats'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label and reading_from_replica():
+            return get_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        # Rows read from the replica are written back to the primary; rows
+        # from any other database stay where they are.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db not in (None, get_replica()):
+            return instance._state.db
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows read from the replica are the primary's rows.
+        databases = {DEFAULT_DB_ALIAS, get_replica()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from replication, never from migrate.
+        if db == get_replica():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Serves replica_actions from the replica unless the user has written
+    recently, and pins users to the primary after their writes.
+    Authentication and view-level permission checks run on the primary;
+    object permissions, checked in get_object(), run on the replica along
+    with the rest of the action.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            get_replica()
+            and self.action in self.replica_actions
+            and request.method in SAFE_METHODS
+            and not is_pinned_to_primary(request.user)
+        ):
+            self.replica_token = _replica_reads.set(True)
+
+    def dispatch(self, request, *args, **kwargs):
+        self.replica_token = None
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.replica_token is not None:
+                _replica_reads.reset(self.replica_token)
+        if (
+            self.request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and self.request.user.is_authenticated
+        ):
+            pin_to_primary(self.request.user)
+        return response
+
+
+def replicate_sqlite(source, target):
+    """
+    Copy the `source` SQLite database over `target` (both connection
+    wrappers) with SQLite's online backup. Readers on the target see the
+    new state on their next transaction.
+    """
+    source.ensure_connection()
+    with sqlite3.connect(target.settings_dict['NAME']) as destination:
+        source.connection.backup(destination)
+    destination.close()
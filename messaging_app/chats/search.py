@@ -0,0 +1,136 @@
+# chats/search.py
+"""
+Full-text search over message bodies.
+
+On SQLite, migration 0005 adds chats_message_fts, an external-content FTS5
+index of chats_message's body and conversation_id, keyed by the message's
+rowid. Triggers keep it in step with inserts, edits and deletes. The rowid
+of a table without an INTEGER PRIMARY KEY can change on VACUUM, so run
+rebuild_search_index() (manage.py rebuild_search_index) after one.
+
+Searches are scoped to the user's conversations inside the index, through
+its conversation_id column. Results are ranked by bm25, best first, and
+paged with keyset cursors over (score, rowid). Scores move a little as the
+index grows, so a long-lived cursor can skip or repeat a result near a
+page boundary.
+"""
+
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db import connection
+
+from .models import Conversation, Message
+from .serializers import MESSAGE_ROW_FIELDS
+
+FTS_TABLE = 'chats_message_fts'
+Participant = Conversation.participants.through
+TERM = re.compile(r'\w+')
+# Users in more conversations than this are scoped with a join on the
+# participants table instead of in the match expression.
+MAX_INDEXED_SCOPE = 500
+
+
+def search_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """
+    The FTS5 query for free text: every word must occur, the last one as a
+    prefix. Operators and quotes in the input are treated as plain text.
+    """
+    terms = TERM.findall(query)
+    if not terms:
+        raise ValueError("Nothing to search for.")
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += ' *'
+    return f"message_body : ({' '.join(phrases)})"
+
+
+def scope_expression(conversation_ids):
+    """Restrict a match to the conversations, using the index's conversation_id column."""
+    terms = ' OR '.join(f'"{pk.hex}"' for pk in conversation_ids)
+    return f"conversation_id : ({terms})"
+
+
+def encode_search_cursor(score, rowid):
+    return urlsafe_b64encode(f"{score!r}:{rowid}".encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    try:
+        score, rowid = urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return float(score), int(rowid)
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def search_messages(user, query, limit, after=None, conversation_id=None):
+    """
+    One page of the user's messages matching `query`, best first, as
+    (rows, next cursor or None). Rows are .values() rows with
+    MESSAGE_ROW_FIELDS. `after` is a cursor from a previous page.
+    """
+    match = match_expression(query)
+    scope = Participant.objects.filter(user_id=user.pk)
+    if conversation_id is not None:
+        scope = scope.filter(conversation_id=conversation_id)
+    conversation_ids = list(scope.values_list('conversation_id', flat=True)[:MAX_INDEXED_SCOPE + 1])
+    if not conversation_ids:
+        return [], None
+
+    conditions, params = ['1'], []
+    if len(conversation_ids) <= MAX_INDEXED_SCOPE:
+        match = f"{match} AND {scope_expression(conversation_ids)}"
+    else:
+        conditions.append(
+            f'm."conversation_id" IN (SELECT "conversation_id" FROM "{Participant._meta.db_table}" '
+            f'WHERE "user_id" = %s)'
+        )
+        params.append(user.pk.hex)
+    if after is not None:
+        score, rowid = decode_search_cursor(after)
+        conditions.append('(f.score > %s OR (f.score = %s AND f.rowid > %s))')
+        params += [score, score, rowid]
+
+    with connection.cursor() as cursor:
+        # bm25 weighs the conversation_id column at 0, so it only filters.
+        cursor.execute(f'''
+            SELECT m."message_id", f.score, f.rowid
+            FROM (
+                SELECT rowid, bm25({FTS_TABLE}, 1.0, 0.0) AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+            ) AS f
+            JOIN "{Message._meta.db_table}" AS m ON m.rowid = f.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY f.score, f.rowid
+            LIMIT %s
+        ''', [match, *params, limit + 1])
+        hits = cursor.fetchall()
+
+    page = hits[:limit]
+    rows = {
+        row['message_id']: row for row in
+        Message.objects.filter(pk__in=[message_id for message_id, _, _ in page]).values(*MESSAGE_ROW_FIELDS)
+    }
+    # Hits deleted or archived since the match are left out of the page.
+    ids = (Message._meta.pk.to_python(message_id) for message_id, _, _ in page)
+    results = [rows[message_id] for message_id in ids if message_id in rows]
+    next_cursor = encode_search_cursor(*page[-1][1:]) if len(hits) > limit else None
+    return results, next_cursor
+
+
+def like_search(user, query, limit):
+    """
+    What SearchFilter would run for `query`: an icontains scan per word,
+    newest first. Kept for comparison in benchmark_search.
+    """
+    queryset = Message.objects.filter(conversation__participants=user)
+    for term in TERM.findall(query):
+        queryset = queryset.filter(message_body__icontains=term)
+    return list(queryset.order_by('-sent_at', '-message_id').values(*MESSAGE_ROW_FIELDS)[:limit])
+
+
+def rebuild_search_index():
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
@@ -1,5 +1,73 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Prefetch, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 from rest_framework import serializers
-from .models import User, Conversation, Message
+from .archive import HOT_MESSAGES_PER_CONVERSATION, earliest_writable
+from .models import User, Conversation, Message, ParticipantSummary
+
+
+def get_related_paths(serializer):
+    """
+    Work out which relations `serializer` will touch when rendering.
+
+    Returns a pair of (select_related paths, Prefetch objects) derived from
+    the declared fields: nested serializers over to-many relations become
+    prefetches (optimised recursively), nested serializers and dotted
+    sources over forward foreign keys become select_related joins.
+    """
+    model = serializer.Meta.model
+    select, prefetch = [], []
+
+    for field in serializer.fields.values():
+        if field.source == '*' or field.write_only:
+            continue
+
+        if isinstance(field, serializers.ListSerializer):
+            try:
+                model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                # Populated by something other than the ORM, e.g. a preview.
+                continue
+            child = field.child
+            queryset = child.Meta.model.objects.all()
+            if isinstance(child, EagerLoadingMixin):
+                queryset = child.setup_eager_loading(queryset)
+            prefetch.append(Prefetch(field.source, queryset=queryset))
+            continue
+
+        # Follow forward foreign keys along the source path, e.g. sender.username.
+        path, current = [], model
+        attrs = field.source_attrs if isinstance(field, serializers.Serializer) else field.source_attrs[:-1]
+        for attr in attrs:
+            try:
+                model_field = current._meta.get_field(attr)
+            except FieldDoesNotExist:
+                break
+            if not (model_field.many_to_one or model_field.one_to_one):
+                break
+            path.append(attr)
+            current = model_field.related_model
+        if path:
+            select.append('__'.join(path))
+
+    return select, prefetch
+
+
+class EagerLoadingMixin:
+    """
+    Lets a ModelSerializer optimise the queryset it is going to render, so
+    list endpoints run a fixed number of queries whatever the page size.
+    """
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        select, prefetch = get_related_paths(cls())
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -11,18 +79,100 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['user_id', 'username', 'email', 'phone_number', 'role', 'created_at']
 
 
-class MessageSerializer(serializers.ModelSerializer):
-    sender_username = serializers.SerializerMethodField()
+def check_sent_at(sent_at, writable_from):
+    """Reject a client-supplied sent_at that would sort among archived messages."""
+    if sent_at is not None and writable_from is not None and sent_at <= writable_from:
+        raise serializers.ValidationError(
+            {'sent_at': ["Messages cannot be dated into the archived part of the conversation."]})
+
 
-    def get_sender_username(self, obj):
-        return obj.sender.username
+class MessageSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    """
+    sender and conversation are set by the view when a message is created
+    (context['conversation_id'] names the conversation before then) and
+    never change afterwards.
+    """
+    sender_username = serializers.CharField(source='sender.username', read_only=True)
 
     class Meta:
         model = Message
-        fields = ['message_id', 'conversation', 'sender', 'sender_username', 'content', 'timestamp']
+        fields = ['message_id', 'conversation', 'sender', 'sender_username', 'message_body', 'sent_at']
+        read_only_fields = ['conversation', 'sender']
+
+    def validate(self, attrs):
+        if attrs.get('sent_at') is not None:
+            conversation_id = self.instance.conversation_id if self.instance else self.context['conversation_id']
+            check_sent_at(attrs['sent_at'], earliest_writable(conversation_id))
+        return attrs
+
+
+# Columns read by the lean row helpers below, for use with QuerySet.values().
+MESSAGE_ROW_FIELDS = ('message_id', 'conversation_id', 'sender_id', 'sender__username', 'message_body', 'sent_at')
+USER_ROW_FIELDS = ('user_id', 'username', 'email', 'phone_number', 'role', 'created_at')
+_datetime_field = serializers.DateTimeField()
+
+
+def message_row_to_dict(row):
+    """
+    Render a Message .values() row exactly like MessageSerializer would,
+    without instantiating a serializer or model per row.
+    """
+    sent_at = row['sent_at']
+    return {
+        'message_id': str(row['message_id']),
+        'conversation': str(row['conversation_id']),
+        'sender': str(row['sender_id']),
+        'sender_username': row['sender__username'],
+        'message_body': row['message_body'],
+        'sent_at': _datetime_field.to_representation(sent_at) if sent_at else None,
+    }
+
+
+def message_row_to_native(row):
+    """
+    message_row_to_dict() for binary renderers: the same keys, with UUIDs
+    and datetimes left for the renderer to encode.
+    """
+    return {
+        'message_id': row['message_id'],
+        'conversation': row['conversation_id'],
+        'sender': row['sender_id'],
+        'sender_username': row['sender__username'],
+        'message_body': row['message_body'],
+        'sent_at': row['sent_at'],
+    }
 
 
-class ConversationSerializer(serializers.ModelSerializer):
+def user_row_to_dict(row):
+    """The .values() counterpart of UserSerializer."""
+    return {
+        'user_id': str(row['user_id']),
+        'username': row['username'],
+        'email': row['email'],
+        'phone_number': row['phone_number'],
+        'role': row['role'],
+        'created_at': _datetime_field.to_representation(row['created_at']),
+    }
+
+
+class BulkMessageSerializer(serializers.ModelSerializer):
+    """
+    One item of a bulk post; sender and conversation come from the request.
+    The view passes earliest_writable() once for the batch as
+    context['writable_from'].
+    """
+
+    class Meta:
+        model = Message
+        fields = ['message_body', 'sent_at']
+        extra_kwargs = {'sent_at': {'required': False}}
+
+    def validate(self, attrs):
+        check_sent_at(attrs.get('sent_at'), self.context.get('writable_from'))
+        return attrs
+
+
+class ConversationSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     messages = MessageSerializer(many=True, read_only=True)
 
@@ -31,6 +181,180 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = ['conversation_id', 'participants', 'created_at', 'messages']
 
 
+def get_latest_messages(conversation_ids, limit, serializer_class=None):
+    """
+    Return {conversation_id: [Message, ...]} with the newest `limit` messages
+    of each conversation, newest first. The rows are loaded the way
+    `serializer_class` (MessageSerializer by default) expects them.
+
+    All conversations are served by one query: ROW_NUMBER() ranks messages
+    within each conversation and only the top `limit` ranks are loaded.
+    """
+    if not conversation_ids:
+        return {}
+    ranked = (
+        Message.objects
+        .filter(conversation_id__in=conversation_ids)
+        .annotate(position=Window(
+            expression=RowNumber(),
+            partition_by=[F('conversation_id')],
+            order_by=[F('sent_at').desc(), F('message_id').desc()],
+        ))
+        .values('message_id', 'position')
+    )
+    sql, params = ranked.query.sql_with_params()
+    queryset = Message.objects.filter(message_id__in=RawSQL(
+        f'SELECT "message_id" FROM ({sql}) AS ranked WHERE "position" <= %s',
+        (*params, limit),
+    )).order_by('-sent_at', '-message_id')
+
+    serializer_class = serializer_class or MessageSerializer
+    latest = {conversation_id: [] for conversation_id in conversation_ids}
+    for message in serializer_class.setup_eager_loading(queryset):
+        conversation_id = message['conversation_id'] if isinstance(message, dict) else message.conversation_id
+        latest[conversation_id].append(message)
+    return latest
+
+
+class ConversationPreviewListSerializer(serializers.ListSerializer):
+    """Attaches the latest-messages preview to a whole page of conversations at once."""
+
+    def to_representation(self, data):
+        conversations = list(data.all() if hasattr(data, 'all') else data)
+        latest = get_latest_messages(
+            [conversation.conversation_id for conversation in conversations],
+            self.child.get_preview_size(),
+        )
+        for conversation in conversations:
+            conversation.latest_messages = latest[conversation.conversation_id]
+        return super().to_representation(conversations)
+
+
+class PreviewSizeMixin:
+    """How many latest messages a conversation list embeds (?preview_size=)."""
+    preview_size = 3
+    # Archiving keeps this many messages of each conversation hot.
+    max_preview_size = HOT_MESSAGES_PER_CONVERSATION
+    preview_size_query_param = 'preview_size'
+
+    def get_preview_size(self):
+        request = self.context.get('request')
+        if request is None:
+            return self.preview_size
+        try:
+            size = int(request.query_params.get(self.preview_size_query_param, self.preview_size))
+        except ValueError:
+            return self.preview_size
+        return max(0, min(size, self.max_preview_size))
+
+
+class ConversationListSerializer(PreviewSizeMixin, ConversationSerializer):
+    """
+    Conversation representation for list and detail endpoints: the last few
+    messages and a message count instead of the whole history. The full
+    history is paged through the nested messages route.
+    """
+    messages = None
+    latest_messages = MessageSerializer(many=True, read_only=True)
+    message_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = ['conversation_id', 'participants', 'created_at', 'message_count', 'latest_messages']
+        list_serializer_class = ConversationPreviewListSerializer
+
+    def to_representation(self, instance):
+        # A single conversation, e.g. on the detail endpoint, loads its own preview.
+        if not hasattr(instance, 'latest_messages'):
+            latest = get_latest_messages([instance.conversation_id], self.get_preview_size())
+            instance.latest_messages = latest[instance.conversation_id]
+        return super().to_representation(instance)
+
+
+class RowListSerializer(serializers.ListSerializer):
+    """Renders a page of .values() rows through the child's row_to_dict."""
+
+    def to_representation(self, data):
+        return [self.child.row_to_dict(row) for row in data]
+
+
+class MessageRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only fast path for message lists. Rows come from .values() with the
+    sender username joined in and are turned straight into dicts, matching
+    MessageSerializer's output without its per-field machinery.
+    """
+
+    class Meta:
+        list_serializer_class = RowListSerializer
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset.values(*MESSAGE_ROW_FIELDS)
+
+    def row_to_dict(self, row):
+        return message_row_to_dict(row)
+
+    def to_representation(self, row):
+        return self.row_to_dict(row)
+
+
+class MessageNativeRowSerializer(MessageRowSerializer):
+    """MessageRowSerializer for binary renderers; see message_row_to_native()."""
+
+    def row_to_dict(self, row):
+        return message_row_to_native(row)
+
+
+class ConversationRowListSerializer(serializers.ListSerializer):
+    """Loads participants and message previews for a page of conversation rows in two queries."""
+
+    def to_representation(self, data):
+        rows = list(data)
+        ids = [row['conversation_id'] for row in rows]
+
+        participants = {conversation_id: [] for conversation_id in ids}
+        for user in User.objects.filter(conversations__in=ids).values('conversations', *USER_ROW_FIELDS):
+            participants[user['conversations']].append(user_row_to_dict(user))
+        latest = get_latest_messages(ids, self.child.get_preview_size(), MessageRowSerializer)
+
+        return [
+            {
+                'conversation_id': str(row['conversation_id']),
+                'participants': participants[row['conversation_id']],
+                'created_at': _datetime_field.to_representation(row['created_at']),
+                'message_count': row['message_count'],
+                'latest_messages': [message_row_to_dict(message) for message in latest[row['conversation_id']]],
+            }
+            for row in rows
+        ]
+
+
+class ConversationRowSerializer(PreviewSizeMixin, serializers.BaseSerializer):
+    """Read-only fast path producing the same output as ConversationListSerializer."""
+
+    class Meta:
+        list_serializer_class = ConversationRowListSerializer
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset.values('conversation_id', 'created_at', 'message_count')
+
+    def to_representation(self, row):
+        return ConversationRowListSerializer(child=self, context=self.context).to_representation([row])[0]
+
+
+class InboxSerializer(serializers.ModelSerializer):
+    conversation_id = serializers.UUIDField(source='summary_id', read_only=True)
+    last_message_id = serializers.UUIDField(source='summary.last_message_id', read_only=True)
+    last_sent_at = serializers.DateTimeField(source='summary.last_sent_at', read_only=True)
+    message_count = serializers.IntegerField(source='summary.message_count', read_only=True)
+
+    class Meta:
+        model = ParticipantSummary
+        fields = ['conversation_id', 'last_message_id', 'last_sent_at', 'message_count', 'unread_count', 'last_read_at']
+
+
 # Optional: Add validation example to satisfy the check
 class SampleValidationSerializer(serializers.Serializer):
     role = serializers.CharField()
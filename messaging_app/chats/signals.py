@@ -0,0 +1,63 @@
+# chats/signals.py
+
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .auth import user_state_cache_key
+from .listcache import Participant, invalidate_conversation, invalidate_conversation_lists
+from .models import Conversation, User
+from .permissions import participation_cache_key
+from .serializers import USER_ROW_FIELDS
+from .summaries import add_participants, remove_participants, touch_summary, touch_user_conversations
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_participation(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep membership caches and summaries in step with participant changes."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if reverse:
+        # user.conversations.add(...): instance is the user
+        pairs = [(conversation_id, instance.pk) for conversation_id in pk_set or
+                 instance.conversations.values_list('pk', flat=True)]
+    else:
+        pairs = [(instance.pk, user_id) for user_id in pk_set or
+                 instance.participants.values_list('pk', flat=True)]
+    cache.delete_many([participation_cache_key(*pair) for pair in pairs])
+    if action == 'post_add':
+        add_participants(pairs)
+    else:
+        remove_participants(pairs)
+    for conversation_id in {conversation_id for conversation_id, _ in pairs}:
+        touch_summary(conversation_id)
+    # Removed users are no longer reached through the conversation.
+    invalidate_conversation_lists(user_id for _, user_id in pairs)
+
+
+@receiver(pre_delete, sender=Conversation)
+def invalidate_deleted_conversation(sender, instance, **kwargs):
+    invalidate_conversation(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_state(sender, instance, **kwargs):
+    """Make deactivation and deletion revoke claim-based tokens straight away."""
+    cache.delete(user_state_cache_key(instance.pk))
+
+
+@receiver(post_save, sender=User)
+@receiver(pre_delete, sender=User)
+def invalidate_peer_lists(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Participants are embedded in conversation lists, so peers' cached pages
+    change with the user, and so do the validators they poll with.
+    """
+    if created or (update_fields and set(update_fields).isdisjoint(USER_ROW_FIELDS)):
+        return
+    touch_user_conversations(instance.pk)
+    conversations = Participant.objects.filter(user_id=instance.pk).values('conversation_id')
+    invalidate_conversation_lists(
+        Participant.objects.filter(conversation_id__in=conversations).values_list('user_id', flat=True))
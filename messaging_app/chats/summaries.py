@@ -0,0 +1,206 @@
+# chats/summaries.py
+"""
+Maintenance of the denormalised ConversationSummary / ParticipantSummary
+tables. Writers call these inside the transaction that changes messages or
+participants; `rebuild_summaries` recreates everything from scratch.
+"""
+
+from collections import Counter
+
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .listcache import invalidate_conversation
+from .models import ArchivedMessage, Conversation, ConversationSummary, Message, ParticipantSummary
+
+Participant = Conversation.participants.through
+
+
+def ensure_summary(conversation):
+    """Create the summary rows for a new conversation and its participants."""
+    summary, _ = ConversationSummary.objects.get_or_create(conversation=conversation)
+    ParticipantSummary.objects.bulk_create(
+        [
+            ParticipantSummary(summary=summary, user_id=user_id)
+            for user_id in conversation.participants.values_list('pk', flat=True)
+        ],
+        ignore_conflicts=True,
+    )
+    return summary
+
+
+def record_message(message):
+    """Account for a newly written message."""
+    record_messages(message.conversation, [message])
+
+
+def record_messages(conversation, messages):
+    """
+    Account for messages newly written to one conversation. Uses relative
+    UPDATEs only, so concurrent writers cannot lose increments.
+    """
+    if not messages:
+        return
+    invalidate_conversation(conversation.pk)
+    latest = max(messages, key=lambda message: (message.sent_at, message.message_id))
+
+    now = timezone.now()
+    summaries = ConversationSummary.objects.filter(conversation_id=conversation.pk)
+    if not summaries.update(message_count=F('message_count') + len(messages), updated_at=now):
+        ensure_summary(conversation)
+        summaries.update(message_count=F('message_count') + len(messages), updated_at=now)
+
+    summaries.filter(
+        Q(last_sent_at__isnull=True) | Q(last_sent_at__lte=latest.sent_at)
+    ).update(last_message=latest, last_sent_at=latest.sent_at)
+
+    senders = Counter(message.sender_id for message in messages)
+    participants = ParticipantSummary.objects.filter(summary_id=conversation.pk)
+    if len(senders) == 1:
+        [sender_id] = senders
+        participants.exclude(user_id=sender_id).update(unread_count=F('unread_count') + len(messages))
+    else:
+        for user_id in participants.values_list('user_id', flat=True):
+            unread = len(messages) - senders.get(user_id, 0)
+            if unread:
+                participants.filter(user_id=user_id).update(unread_count=F('unread_count') + unread)
+
+
+def add_participants(pairs):
+    """Give newly added (conversation_id, user_id) pairs their read state."""
+    existing = set(ConversationSummary.objects.filter(
+        conversation_id__in={conversation_id for conversation_id, _ in pairs},
+    ).values_list('pk', flat=True))
+    ParticipantSummary.objects.bulk_create(
+        [
+            ParticipantSummary(summary_id=conversation_id, user_id=user_id)
+            for conversation_id, user_id in pairs if conversation_id in existing
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_participants(pairs):
+    for conversation_id, user_id in pairs:
+        ParticipantSummary.objects.filter(summary_id=conversation_id, user_id=user_id).delete()
+
+
+def touch_summary(conversation_id):
+    """Record that the conversation changed without adding messages."""
+    invalidate_conversation(conversation_id)
+    ConversationSummary.objects.filter(conversation_id=conversation_id).update(updated_at=timezone.now())
+
+
+def touch_user_conversations(user_id):
+    """
+    Record that every conversation the user takes part in changed, e.g.
+    because their profile, which the conversation listings embed, did.
+    """
+    conversations = Participant.objects.filter(user_id=user_id).values('conversation_id')
+    ConversationSummary.objects.filter(conversation_id__in=conversations).update(updated_at=timezone.now())
+
+
+def refresh_summary(conversation_id):
+    """
+    Recompute one conversation's count and last message, for changes that
+    relative updates cannot express, such as deleting a message. Archived
+    messages count too.
+    """
+    invalidate_conversation(conversation_id)
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    last_message = messages.order_by('-sent_at', '-message_id').first()
+    archived = ArchivedMessage.objects.filter(conversation_id=conversation_id)
+    ConversationSummary.objects.filter(conversation_id=conversation_id).update(
+        message_count=messages.count() + archived.count(),
+        last_message=last_message,
+        last_sent_at=last_message.sent_at if last_message else None,
+        updated_at=timezone.now(),
+    )
+
+
+def conversation_version(conversation_id):
+    """(version, last modified) of one conversation, or None without a summary."""
+    row = ConversationSummary.objects.filter(conversation_id=conversation_id).values_list(
+        'message_count', 'last_message_id', 'updated_at').first()
+    if row is None:
+        return None
+    message_count, last_message_id, updated_at = row
+    return f"{message_count}:{last_message_id}:{updated_at.isoformat()}", updated_at
+
+
+def user_conversations_version(user):
+    """(version, last modified) covering every conversation the user takes part in."""
+    row = ParticipantSummary.objects.filter(user=user).aggregate(
+        conversations=Count('id'), updated_at=Max('summary__updated_at'))
+    updated_at = row['updated_at']
+    return f"{row['conversations']}:{updated_at.isoformat() if updated_at else ''}", updated_at
+
+
+def mark_read(conversation, user):
+    ParticipantSummary.objects.filter(summary_id=conversation.pk, user=user).update(
+        unread_count=0, last_read_at=timezone.now(),
+    )
+
+
+def rebuild_summaries(batch_size=1000):
+    """
+    Recompute every summary from Message and the participants table.
+    Read markers (last_read_at) survive the rebuild; unread counts are
+    derived from them. Archived messages count towards the totals, not
+    towards unread counts.
+    """
+    last_read = {
+        (row['summary_id'], row['user_id']): row['last_read_at']
+        for row in ParticipantSummary.objects.exclude(last_read_at=None).values(
+            'summary_id', 'user_id', 'last_read_at')
+    }
+    ConversationSummary.objects.all().delete()
+
+    last_message = Message.objects.filter(
+        conversation_id=OuterRef('pk'),
+    ).order_by('-sent_at', '-message_id').values('message_id')[:1]
+    archived = ArchivedMessage.objects.filter(conversation_id=OuterRef('pk'))
+    conversations = Conversation.objects.annotate(
+        total=Count('messages') + Coalesce(Subquery(_count(archived)), 0),
+        latest=Max('messages__sent_at'),
+        latest_id=Subquery(last_message),
+    ).values_list('pk', 'total', 'latest', 'latest_id')
+    ConversationSummary.objects.bulk_create(
+        (
+            ConversationSummary(
+                conversation_id=pk, message_count=total,
+                last_sent_at=latest, last_message_id=latest_id,
+            )
+            for pk, total, latest, latest_id in conversations.iterator()
+        ),
+        batch_size=batch_size,
+    )
+
+    ParticipantSummary.objects.bulk_create(
+        (
+            ParticipantSummary(
+                summary_id=conversation_id, user_id=user_id,
+                last_read_at=last_read.get((conversation_id, user_id)),
+            )
+            for conversation_id, user_id in Participant.objects.values_list(
+                'conversation_id', 'user_id').iterator()
+        ),
+        batch_size=batch_size,
+    )
+
+    unread = Message.objects.filter(
+        conversation_id=OuterRef('summary_id'),
+    ).exclude(
+        sender_id=OuterRef('user_id'),
+    )
+    ParticipantSummary.objects.filter(last_read_at=None).update(
+        unread_count=Coalesce(Subquery(_count(unread)), 0),
+    )
+    ParticipantSummary.objects.exclude(last_read_at=None).update(
+        unread_count=Coalesce(Subquery(_count(unread.filter(sent_at__gt=OuterRef('last_read_at')))), 0),
+    )
+
+
+def _count(queryset):
+    return queryset.order_by().values('conversation_id').annotate(n=Count('*')).values('n')
@@ -1,3 +1,1662 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.contrib.sessions.models import Session
+from django.db import connection, connections
+from django.db.utils import ConnectionHandler
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .archive import HOT_MESSAGES_PER_CONVERSATION, archive_cutoff, archive_messages
+from .auth import get_tokens_for_user, timing_stats
+from . import listcache
+from .binary import decode_timestamp, packb, unpack_stream, unpackb
+from .middleware import choose_encoding, flush_points, gzip_stream
+from .models import ArchivedMessage, User, Conversation, ConversationSummary, Message
+from .permissions import is_participant
+from .realtime import conversation_channel, get_broker, reset_broker
+from .renderers import FastJSONRenderer
+from .routers import ReplicaRouter, replica_reads, replicate_sqlite
+from .serializers import MessageSerializer
+from .views import (
+    ConversationViewSet, MessageViewSet, conversation_collection, message_collection, message_detail,
+)
+from .websocket import websocket_application
+from .summaries import conversation_version, ensure_summary, rebuild_summaries, record_messages
+
+
+def make_user(username):
+    return User.objects.create_user(
+        username=username,
+        email=f"{username}@example.com",
+        password='pass1234',
+        first_name=username,
+        last_name='Test',
+    )
+
+
+class ChatsTestCase(TestCase):
+    """Two participants sharing a conversation, plus an outsider."""
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.eve = make_user('eve')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def add_messages(self, count, conversation=None, sent_at=None):
+        conversation = conversation or self.conversation
+        start = timezone.now() - timedelta(hours=1)
+        return Message.objects.bulk_create([
+            Message(
+                conversation=conversation,
+                sender=self.alice if i % 2 else self.bob,
+                message_body=f"message {i}",
+                sent_at=sent_at or start + timedelta(seconds=i),
+            )
+            for i in range(count)
+        ])
+
+    def messages_url(self, conversation=None):
+        conversation = conversation or self.conversation
+        return f"/api/conversations/{conversation.conversation_id}/messages/"
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url, page_sizes=(1, 5, 20)):
+        """Assert that listing `url` costs the same number of queries at every page size."""
+        separator = '&' if '?' in url else '?'
+        counts = {
+            size: self.count_queries(f"{url}{separator}page_size={size}")
+            for size in page_sizes
+        }
+        self.assertEqual(len(set(counts.values())), 1, f"query count varies with page size: {counts}")
+        return counts[page_sizes[0]]
+
+
+class MessageCursorPaginationTests(ChatsTestCase):
+
+    def follow(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data['next']
+        return pages
+
+    def test_walks_history_newest_first_without_gaps(self):
+        self.add_messages(45)
+        pages = self.follow(self.messages_url() + '?page_size=10')
+
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 10, 10, 5])
+        bodies = [row['message_body'] for page in pages for row in page['results']]
+        self.assertEqual(bodies, [f"message {i}" for i in range(44, -1, -1)])
+        self.assertEqual(pages[0]['count'], 45)
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_ties_on_sent_at_are_broken_by_message_id(self):
+        self.add_messages(7, sent_at=timezone.now())
+        pages = self.follow(self.messages_url() + '?page_size=3')
+
+        ids = [row['message_id'] for page in pages for row in page['results']]
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(set(ids)), 7)
+
+    def test_previous_cursor_returns_the_page_before(self):
+        self.add_messages(25)
+        first = self.client.get(self.messages_url() + '?page_size=10').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_skip_count(self):
+        self.add_messages(3)
+        response = self.client.get(self.messages_url() + '?skip_count=true')
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.messages_url() + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_mode_still_available(self):
+        self.add_messages(25)
+        response = self.client.get(self.messages_url() + '?page=2&page_size=10')
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_only_messages_of_the_routed_conversation(self):
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.eve])
+        self.add_messages(3)
+        self.add_messages(4, conversation=other)
+
+        response = self.client.get(self.messages_url())
+        self.assertEqual(response.data['count'], 3)
+
+
+class QueryCountTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(20):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob, self.eve])
+            self.add_messages(3, conversation=conversation)
+        self.add_messages(30)
+
+    def test_conversation_list(self):
+        self.assertConstantQueries('/api/conversations/')
+
+    def test_message_list(self):
+        self.assertConstantQueries(self.messages_url())
+
+    def test_message_list_page_number_mode(self):
+        self.assertConstantQueries(self.messages_url() + '?page=1')
+
+
+class ConversationPreviewTests(ChatsTestCase):
+
+    def test_list_embeds_only_latest_messages(self):
+        self.add_messages(10)
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.eve])
+        self.add_messages(1, conversation=other)
+        empty = Conversation.objects.create()
+        empty.participants.set([self.alice, self.bob])
+
+        response = self.client.get('/api/conversations/')
+        rows = {row['conversation_id']: row for row in response.data['results']}
+
+        row = rows[str(self.conversation.conversation_id)]
+        self.assertNotIn('messages', row)
+        self.assertEqual(row['message_count'], 10)
+        self.assertEqual(
+            [message['message_body'] for message in row['latest_messages']],
+            ['message 9', 'message 8', 'message 7'],
+        )
+        self.assertEqual(rows[str(other.conversation_id)]['message_count'], 1)
+        self.assertEqual(len(rows[str(other.conversation_id)]['latest_messages']), 1)
+        self.assertEqual(rows[str(empty.conversation_id)]['message_count'], 0)
+        self.assertEqual(rows[str(empty.conversation_id)]['latest_messages'], [])
+
+    def test_preview_size_is_bounded(self):
+        self.add_messages(30)
+        response = self.client.get('/api/conversations/?preview_size=1')
+        self.assertEqual(len(response.data['results'][0]['latest_messages']), 1)
+        response = self.client.get('/api/conversations/?preview_size=500')
+        self.assertEqual(len(response.data['results'][0]['latest_messages']), 20)
+
+    def test_detail_embeds_only_latest_messages(self):
+        self.add_messages(10)
+        url = f"/api/conversations/{self.conversation.conversation_id}/"
+        response = self.client.get(url)
+        self.assertNotIn('messages', response.data)
+        self.assertEqual(response.data['message_count'], 10)
+        self.assertEqual(
+            [message['message_body'] for message in response.data['latest_messages']],
+            ['message 9', 'message 8', 'message 7'],
+        )
+        response = self.client.get(f"{url}?preview_size=500")
+        self.assertEqual(len(response.data['latest_messages']), 10)
+        # The whole history stays behind the paginated messages route.
+        self.assertEqual(self.client.get(self.messages_url()).data['count'], 10)
+
+
+class ConversationSummaryTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        ensure_summary(self.conversation)
+
+    def send(self, body, user=None, conversation=None):
+        self.client.force_authenticate(user or self.alice)
+        response = self.client.post(self.messages_url(conversation), {'message_body': body}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response
+
+    def inbox(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get('/api/conversations/inbox/').data['results']
+
+    def test_create_conversation_creates_summaries(self):
+        response = self.client.post('/api/conversations/', {'participants': [str(self.eve.pk)]}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        summary = ConversationSummary.objects.get(conversation_id=response.data['conversation_id'])
+        self.assertEqual(summary.participants.count(), 2)
+
+    def test_message_create_updates_summary(self):
+        self.send('hi')
+        reply = self.send('hello', user=self.bob)
+
+        summary = ConversationSummary.objects.get(conversation=self.conversation)
+        self.assertEqual(summary.message_count, 2)
+        self.assertEqual(str(summary.last_message_id), reply.data['message_id'])
+        [alice] = self.inbox(self.alice)
+        [bob] = self.inbox(self.bob)
+        self.assertEqual(alice['unread_count'], 1)
+        self.assertEqual(bob['unread_count'], 1)
+
+    def test_inbox_sorted_by_activity_and_reads_only_summaries(self):
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.eve])
+        ensure_summary(other)
+        self.send('first')
+        self.send('second', conversation=other)
+
+        self.client.force_authenticate(self.alice)
+        with CaptureQueriesContext(connection) as context:
+            rows = self.client.get('/api/conversations/inbox/').data['results']
+        self.assertEqual([row['conversation_id'] for row in rows],
+                         [str(other.pk), str(self.conversation.pk)])
+        for query in context.captured_queries:
+            self.assertNotIn('"chats_message"', query['sql'])
+
+    def test_mark_read(self):
+        self.send('hi', user=self.bob)
+        self.client.force_authenticate(self.alice)
+        response = self.client.post(f"/api/conversations/{self.conversation.pk}/read/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.inbox(self.alice)[0]['unread_count'], 0)
+
+    def test_redating_a_message_moves_the_last_message(self):
+        first = self.send('first').data
+        self.send('second')
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.eve])
+        ensure_summary(other)
+        self.send('other', conversation=other)
+
+        later = (timezone.now() + timedelta(minutes=5)).isoformat()
+        response = self.client.patch(f"{self.messages_url()}{first['message_id']}/", {'sent_at': later}, format='json')
+        self.assertEqual(response.status_code, 200)
+        summary = ConversationSummary.objects.get(conversation=self.conversation)
+        self.assertEqual(str(summary.last_message_id), first['message_id'])
+        self.assertEqual(summary.last_sent_at, Message.objects.get(pk=first['message_id']).sent_at)
+        self.assertEqual(self.inbox(self.alice)[0]['conversation_id'], str(self.conversation.pk))
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        self.send('one')
+        self.send('two', user=self.bob)
+        self.send('three', user=self.bob)
+        self.client.force_authenticate(self.bob)
+        self.client.post(f"/api/conversations/{self.conversation.pk}/read/")
+        self.send('four')
+        expected = {user.username: self.inbox(user) for user in (self.alice, self.bob)}
+
+        call_command('rebuild_conversation_summaries', stdout=StringIO())
+
+        self.assertEqual({user.username: self.inbox(user) for user in (self.alice, self.bob)}, expected)
+        self.assertEqual(expected['alice'][0]['unread_count'], 2)
+        self.assertEqual(expected['bob'][0]['unread_count'], 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(ChatsTestCase):
+    """Hot list queries must be served from indexes, never full table scans."""
+    hot_tables = ('chats_message', 'chats_conversation_participants')
+
+    def setUp(self):
+        super().setUp()
+        self.add_messages(30)
+
+    def query_plans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        return response, plans
+
+    def assertNoFullScans(self, url):
+        response, plans = self.query_plans(url)
+        for sql, plan in plans:
+            for step in plan:
+                for table in self.hot_tables:
+                    self.assertIsNone(
+                        re.match(rf'SCAN (TABLE )?{table}\b(?!.*USING)', step),
+                        f"full scan of {table}:\n{sql}\n{plan}",
+                    )
+        return response, plans
+
+    def assertOrderedByIndex(self, plans):
+        for sql, plan in plans:
+            if 'FROM "chats_message"' in sql and 'ORDER BY' in sql:
+                self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, f"sorts in memory:\n{sql}\n{plan}")
+
+    def test_message_history_first_page(self):
+        _, plans = self.assertNoFullScans(self.messages_url())
+        self.assertOrderedByIndex(plans)
+
+    def test_message_history_next_page(self):
+        first = self.client.get(self.messages_url() + '?page_size=5').data
+        _, plans = self.assertNoFullScans(first['next'])
+        self.assertOrderedByIndex(plans)
+        # The cursor must seek into the index, not filter from the newest row.
+        steps = [step for _, plan in plans for step in plan]
+        self.assertTrue(any('message_conv_sent_idx (conversation_id=? AND sent_at<?)' in step for step in steps), steps)
+
+    def test_message_history_filtered(self):
+        after = (timezone.now() - timedelta(minutes=59, seconds=50)).isoformat()
+        url = f"{self.messages_url()}?{urlencode({'sender': self.bob.pk, 'sent_at_after': after})}"
+        _, plans = self.assertNoFullScans(url)
+        self.assertOrderedByIndex(plans)
+        steps = [step for _, plan in plans for step in plan]
+        self.assertTrue(any(
+            'message_conv_sender_sent_idx (conversation_id=? AND sender_id=? AND sent_at>?)' in step
+            for step in steps
+        ), steps)
+
+        url = f"{self.messages_url()}?{urlencode({'sent_at_after': after, 'sent_at_before': timezone.now().isoformat()})}"
+        _, plans = self.assertNoFullScans(url)
+        self.assertOrderedByIndex(plans)
+        steps = [step for _, plan in plans for step in plan]
+        self.assertTrue(any(
+            'message_conv_sent_idx (conversation_id=? AND sent_at>? AND sent_at<?)' in step for step in steps
+        ), steps)
+
+    def test_conversation_list(self):
+        self.assertNoFullScans('/api/conversations/')
+
+    def test_inbox(self):
+        self.assertNoFullScans('/api/conversations/inbox/')
+
+
+class ParticipationTests(ChatsTestCase):
+
+    def request_for(self, user):
+        request = APIRequestFactory().get('/')
+        request.user = user
+        return request
+
+    def test_single_exists_query_memoised_per_request(self):
+        request = self.request_for(self.alice)
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(is_participant(request, self.conversation.pk))
+            self.assertTrue(is_participant(request, str(self.conversation.pk)))
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertIn('LIMIT 1', context.captured_queries[0]['sql'])
+        self.assertFalse(is_participant(self.request_for(self.eve), self.conversation.pk))
+
+    @override_settings(CHATS_PARTICIPATION_CACHE_TIMEOUT=60)
+    def test_shared_cache_is_invalidated_when_participants_change(self):
+        cache.clear()
+        self.assertFalse(is_participant(self.request_for(self.eve), self.conversation.pk))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_participant(self.request_for(self.eve), self.conversation.pk))
+
+        self.conversation.participants.add(self.eve)
+        self.assertTrue(is_participant(self.request_for(self.eve), self.conversation.pk))
+
+        self.eve.conversations.remove(self.conversation)
+        self.assertFalse(is_participant(self.request_for(self.eve), self.conversation.pk))
+
+        self.conversation.participants.add(self.eve)
+        self.assertTrue(is_participant(self.request_for(self.eve), self.conversation.pk))
+        self.conversation.participants.clear()
+        self.assertFalse(is_participant(self.request_for(self.eve), self.conversation.pk))
+
+    def test_create_checks_membership(self):
+        url = self.messages_url()
+        self.client.force_authenticate(self.eve)
+        response = self.client.post(url, {'message_body': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post('/api/conversations/00000000-0000-0000-0000-000000000000/messages/',
+                                    {'message_body': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_object_permission(self):
+        [message] = self.add_messages(1)
+        self.client.force_authenticate(self.eve)
+        response = self.client.get(f"/api/conversations/{self.conversation.pk}/")
+        self.assertEqual(response.status_code, 404)
+        self.client.force_authenticate(self.bob)
+        response = self.client.get(f"{self.messages_url()}{message.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_sender_and_conversation_cannot_be_reassigned(self):
+        elsewhere = Conversation.objects.create()
+        elsewhere.participants.set([self.eve])
+        response = self.client.post(self.messages_url(), {
+            'message_body': 'hi', 'sender': str(self.bob.pk), 'conversation': str(elsewhere.pk),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get(pk=response.data['message_id'])
+        self.assertEqual((message.sender, message.conversation), (self.alice, self.conversation))
+
+        response = self.client.patch(f"{self.messages_url()}{message.pk}/", {
+            'message_body': 'edited', 'sender': str(self.bob.pk), 'conversation': str(elsewhere.pk),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        message.refresh_from_db()
+        self.assertEqual((message.message_body, message.sender, message.conversation),
+                         ('edited', self.alice, self.conversation))
+
+
+class BulkMessageTests(ChatsTestCase):
+
+    def bulk_url(self, conversation=None):
+        return self.messages_url(conversation) + 'bulk/'
+
+    def test_bulk_create(self):
+        ensure_summary(self.conversation)
+        payload = {'messages': [{'message_body': f"bulk {i}"} for i in range(50)]}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.bulk_url(), payload, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['created'], 50)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 50)
+        inserts = [q for q in context.captured_queries if q['sql'].startswith('INSERT INTO "chats_message"')]
+        self.assertEqual(len(inserts), 1)
+
+        summary = ConversationSummary.objects.get(conversation=self.conversation)
+        self.assertEqual(summary.message_count, 50)
+        self.assertEqual(summary.participants.get(user=self.bob).unread_count, 50)
+        self.assertEqual(summary.participants.get(user=self.alice).unread_count, 0)
+
+    def test_per_item_results(self):
+        payload = {'messages': [{'message_body': 'ok'}, {'message_body': ''}, {'sent_at': 'yesterday'}]}
+        response = self.client.post(self.bulk_url(), payload, format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created', 'rejected', 'rejected'])
+        self.assertIn('message_body', response.data['results'][1]['errors'])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_rejects_outsiders_and_oversized_batches(self):
+        self.client.force_authenticate(self.eve)
+        response = self.client.post(self.bulk_url(), {'messages': [{'message_body': 'x'}]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(self.alice)
+        payload = {'messages': [{'message_body': 'x'}] * 501}
+        response = self.client.post(self.bulk_url(), payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+class ExportTests(ChatsTestCase):
+
+    def test_streams_ndjson_oldest_first(self):
+        messages = self.add_messages(25)
+        response = self.client.get(self.messages_url() + 'export/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['message_body'] for row in rows], [f"message {i}" for i in range(25)])
+
+        # Each row matches the regular serializer output.
+        expected = MessageSerializer(Message.objects.get(pk=messages[0].pk)).data
+        self.assertEqual(rows[0], json.loads(JSONRenderer().render(expected)))
+
+    def test_rows_are_sent_in_batches(self):
+        self.add_messages(25)
+        with patch.object(MessageViewSet, 'export_chunk_size', 10):
+            chunks = list(self.client.get(self.messages_url() + 'export/').streaming_content)
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [10, 10, 5])
+
+    def test_outsider_cannot_export(self):
+        self.client.force_authenticate(self.eve)
+        response = self.client.get(self.messages_url() + 'export/')
+        self.assertEqual(response.status_code, 403)
+
+
+class FastSerializerTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bob.phone_number = '555-0100'
+        self.bob.save()
+        for i in range(3):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob, self.eve])
+            self.add_messages(i * 2, conversation=conversation)
+        self.add_messages(12)
+
+    def both_ways(self, url):
+        fast = self.client.get(url)
+        with patch.object(ConversationViewSet, 'use_fast_serializers', False), \
+                patch.object(MessageViewSet, 'use_fast_serializers', False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        return json.loads(fast.content), json.loads(slow.content)
+
+    def test_message_list_matches_model_serializer(self):
+        fast, slow = self.both_ways(self.messages_url() + '?page_size=5')
+        self.assertEqual(fast, slow)
+        fast, slow = self.both_ways(fast['next'])
+        self.assertEqual(fast, slow)
+
+    def test_conversation_list_matches_model_serializer(self):
+        fast, slow = self.both_ways('/api/conversations/?preview_size=4')
+        self.assertEqual(fast, slow)
+
+    def test_browsable_api_still_renders(self):
+        response = self.client.get(self.messages_url(), HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        ensure_summary(self.conversation)
+
+    def send(self, body):
+        response = self.client.post(self.messages_url(), {'message_body': body}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def assertRevalidates(self, url):
+        """Return the ETag after checking a repeat request gets a cheap 304."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        for query in context.captured_queries:
+            self.assertNotIn('"chats_message"', query['sql'])
+        return etag
+
+    def test_message_list(self):
+        self.send('one')
+        etag = self.assertRevalidates(self.messages_url())
+
+        message = self.send('two')
+        self.assertNotEqual(self.assertRevalidates(self.messages_url()), etag)
+        etag = self.assertRevalidates(self.messages_url())
+
+        self.client.patch(f"{self.messages_url()}{message['message_id']}/", {'message_body': 'edited'}, format='json')
+        self.assertNotEqual(self.assertRevalidates(self.messages_url()), etag)
+        etag = self.assertRevalidates(self.messages_url())
+
+        self.client.delete(f"{self.messages_url()}{message['message_id']}/")
+        self.assertNotEqual(self.assertRevalidates(self.messages_url()), etag)
+        self.assertEqual(ConversationSummary.objects.get(conversation=self.conversation).message_count, 1)
+
+    def test_etag_depends_on_query_and_user(self):
+        self.send('one')
+        etag = self.assertRevalidates(self.messages_url())
+        self.assertNotEqual(self.assertRevalidates(self.messages_url() + '?page_size=5'), etag)
+        self.client.force_authenticate(self.bob)
+        self.assertNotEqual(self.assertRevalidates(self.messages_url()), etag)
+
+    def test_conversation_list_and_detail(self):
+        list_etag = self.assertRevalidates('/api/conversations/')
+        detail_url = f"/api/conversations/{self.conversation.pk}/"
+        detail_etag = self.assertRevalidates(detail_url)
+
+        self.send('hello')
+        self.assertNotEqual(self.assertRevalidates('/api/conversations/'), list_etag)
+        self.assertNotEqual(self.assertRevalidates(detail_url), detail_etag)
+
+        list_etag = self.assertRevalidates('/api/conversations/')
+        self.client.post('/api/conversations/', {'participants': [str(self.eve.pk)]}, format='json')
+        self.assertNotEqual(self.assertRevalidates('/api/conversations/'), list_etag)
+
+    def test_peer_profile_changes_change_the_validators(self):
+        list_etag = self.assertRevalidates('/api/conversations/')
+        detail_url = f"/api/conversations/{self.conversation.pk}/"
+        detail_etag = self.assertRevalidates(detail_url)
+
+        # Fields the listings do not embed leave the validators alone.
+        self.bob.last_login = timezone.now()
+        self.bob.save(update_fields=['last_login'])
+        self.assertEqual(self.assertRevalidates('/api/conversations/'), list_etag)
+
+        self.bob.email = 'robert@example.com'
+        self.bob.save()
+        response = self.client.get('/api/conversations/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+        emails = {user['email'] for user in response.json()['results'][0]['participants']}
+        self.assertIn('robert@example.com', emails)
+        self.assertNotEqual(self.assertRevalidates(detail_url), detail_etag)
+
+    def test_outsiders_get_no_validators(self):
+        self.send('one')
+        etag = self.client.get(self.messages_url())['ETag']
+        self.client.force_authenticate(self.eve)
+        response = self.client.get(f"/api/conversations/{self.conversation.pk}/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class WebSocketClient:
+    """Drives the ASGI WebSocket app in-process, like a connected browser."""
+
+    def __init__(self, path, query_string=b'', headers=()):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'query_string': query_string, 'headers': list(headers)}
+        self.task = asyncio.ensure_future(websocket_application(scope, self.outgoing.get, self.incoming.put))
+
+    async def connect(self):
+        await self.outgoing.put({'type': 'websocket.connect'})
+        return await asyncio.wait_for(self.incoming.get(), 5)
+
+    async def receive_json(self):
+        event = await asyncio.wait_for(self.incoming.get(), 5)
+        return json.loads(event['text'])
+
+    async def disconnect(self):
+        await self.outgoing.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+class WebSocketTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reset_broker()
+        self.path = f"/ws/conversations/{self.conversation.pk}/"
+
+    def token_for(self, user):
+        return f"token={AccessToken.for_user(user)}".encode()
+
+    def send(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.messages_url(), {'message_body': body}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_pushes_committed_messages(self):
+        async def scenario():
+            socket = WebSocketClient(self.path, self.token_for(self.bob))
+            self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+
+            sent = await sync_to_async(self.send)('hello')
+            event = await socket.receive_json()
+            self.assertEqual(event['type'], 'message')
+            self.assertEqual(event['message']['message_body'], 'hello')
+            self.assertEqual(event['message']['message_id'], str(sent['message_id']))
+
+            await socket.disconnect()
+            self.assertEqual(get_broker().subscriber_count(conversation_channel(self.conversation.pk)), 0)
+
+        async_to_sync(scenario)()
+
+    def test_bearer_header(self):
+        async def scenario():
+            token = str(AccessToken.for_user(self.bob)).encode()
+            socket = WebSocketClient(self.path, headers=[(b'authorization', b'Bearer ' + token)])
+            self.assertEqual((await socket.connect())['type'], 'websocket.accept')
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_rejects_outsiders_and_bad_tokens(self):
+        async def scenario():
+            for query in (self.token_for(self.eve), b'token=nonsense', b''):
+                socket = WebSocketClient(self.path, query)
+                self.assertEqual(await socket.connect(), {'type': 'websocket.close', 'code': 4403})
+            socket = WebSocketClient('/ws/elsewhere/', self.token_for(self.bob))
+            self.assertEqual((await socket.connect())['code'], 4404)
+
+        async_to_sync(scenario)()
+
+    def test_rolled_back_messages_are_not_pushed(self):
+        published = []
+        with patch('chats.views.publish_messages', lambda *args: published.append(args)):
+            self.client.post(self.messages_url(), {'message_body': 'not committed'}, format='json')
+        self.assertEqual(published, [])
+
+
+class LongPollTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reset_broker()
+        self.url = self.messages_url() + 'since/'
+        self.token = AccessToken.for_user(self.bob)
+
+    def send(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.messages_url(), {'message_body': body}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    async def poll(self, **params):
+        # Django 3.2's AsyncClient turns extra kwargs (QUERY_STRING included)
+        # into raw header names, so the query goes in the URL.
+        headers = {'authorization': f"Bearer {self.token}"} if self.token else {}
+        response = await self.async_client.get(f"{self.url}?{urlencode(params)}", **headers)
+        return response.status_code, json.loads(response.content)
+
+    async def test_returns_newer_messages_immediately(self):
+        await sync_to_async(self.add_messages)(3)
+        status_code, start = await self.poll()
+        self.assertEqual(status_code, 200)
+        self.assertEqual(start['results'], [])
+
+        await sync_to_async(self.send)('four')
+        await sync_to_async(self.send)('five')
+        status_code, data = await self.poll(cursor=start['cursor'], timeout=5)
+        self.assertEqual([row['message_body'] for row in data['results']], ['four', 'five'])
+
+        status_code, data = await self.poll(cursor=data['cursor'], timeout=0.05)
+        self.assertEqual(data['results'], [])
+
+    async def test_wakes_up_when_a_message_is_committed(self):
+        await sync_to_async(self.add_messages)(1)
+        _, start = await self.poll()
+
+        waiting = asyncio.ensure_future(self.poll(cursor=start['cursor'], timeout=10))
+        while not get_broker().subscriber_count(conversation_channel(self.conversation.pk)):
+            await asyncio.sleep(0.01)
+        await sync_to_async(self.send)('wake up')
+
+        status_code, data = await asyncio.wait_for(waiting, 5)
+        self.assertEqual([row['message_body'] for row in data['results']], ['wake up'])
+
+    async def test_rejects_outsiders(self):
+        self.token = AccessToken.for_user(self.eve)
+        self.assertEqual((await self.poll())[0], 403)
+        self.token = None
+        self.assertEqual((await self.poll())[0], 401)
+
+    async def test_invalid_cursor(self):
+        self.assertEqual((await self.poll(cursor='nope'))[0], 400)
+
+
+class AsyncViewTests(TransactionTestCase):
+    # The async views run the ORM on pool threads, with their own database
+    # connections, so the fixtures have to be committed.
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        ensure_summary(self.conversation)
+        self.factory = AsyncRequestFactory()
+        self.authorization = f"Bearer {AccessToken.for_user(self.alice)}"
+        self.url = f"/api/conversations/{self.conversation.pk}/messages/"
+
+    async def call(self, view, method, path, data=None, **kwargs):
+        # AsyncRequestFactory sends extra kwargs as raw header names.
+        make_request = getattr(self.factory, method)
+        if data is None:
+            request = make_request(path, authorization=self.authorization)
+        else:
+            request = make_request(path, data, content_type='application/json', authorization=self.authorization)
+        response = await view(request, **kwargs)
+        return response.status_code, json.loads(response.content) if response.content else None
+
+    async def test_create_and_list_match_the_sync_viewset(self):
+        status_code, created = await self.call(
+            message_collection, 'post', self.url, {'message_body': 'hello'},
+            conversation_pk=self.conversation.pk,
+        )
+        self.assertEqual(status_code, 201)
+        self.assertEqual(created['message_body'], 'hello')
+
+        status_code, page = await self.call(message_collection, 'get', self.url, conversation_pk=self.conversation.pk)
+        self.assertEqual(status_code, 200)
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        expected = await sync_to_async(client.get)(self.url)
+        self.assertEqual(page, json.loads(expected.content))
+        summary = await sync_to_async(ConversationSummary.objects.get)(pk=self.conversation.pk)
+        self.assertEqual(summary.message_count, 1)
+
+        status_code, conversations = await self.call(conversation_collection, 'get', '/api/conversations/')
+        self.assertEqual([row['conversation_id'] for row in conversations['results']], [str(self.conversation.pk)])
+
+    async def test_detail_view_keeps_write_actions(self):
+        _, created = await self.call(
+            message_collection, 'post', self.url, {'message_body': 'hello'},
+            conversation_pk=self.conversation.pk,
+        )
+        detail = f"{self.url}{created['message_id']}/"
+        kwargs = {'conversation_pk': self.conversation.pk, 'pk': created['message_id']}
+        self.assertEqual((await self.call(message_detail, 'delete', detail, **kwargs))[0], 204)
+        self.assertEqual((await self.call(message_detail, 'get', detail, **kwargs))[0], 404)
+
+    async def test_requests_run_concurrently(self):
+        # Both requests must be inside the view at once to pass the barrier;
+        # on Django's single sync thread the second would never get in.
+        barrier = threading.Barrier(2, timeout=5)
+        original = MessageViewSet.list
+
+        def list_(viewset, request, *args, **kwargs):
+            barrier.wait()
+            return original(viewset, request, *args, **kwargs)
+
+        with patch.object(MessageViewSet, 'list', list_):
+            results = await asyncio.gather(*(
+                self.call(message_collection, 'get', self.url, conversation_pk=self.conversation.pk)
+                for _ in range(2)
+            ))
+        self.assertEqual([status_code for status_code, _ in results], [200, 200])
+
+    async def test_export_streams_under_asgi(self):
+        from messaging_app.asgi import application
+
+        await sync_to_async(Message.objects.bulk_create)([
+            Message(conversation=self.conversation, sender=self.alice, message_body=f"message {i}")
+            for i in range(5)
+        ])
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': f"{self.url}export/", 'root_path': '', 'query_string': b'', 'server': ('testserver', 80),
+            'headers': [(b'host', b'testserver'), (b'authorization', self.authorization.encode())],
+        }
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        await application(scope, receive, send)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(sent[-1], {'type': 'http.response.body'})
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertEqual([json.loads(line)['message_body'] for line in body.splitlines()],
+                         [f"message {i}" for i in range(5)])
+
+    def test_asgi_urlconf_routes_only_crud_to_async_views(self):
+        urlconf = 'messaging_app.asgi_urls'
+        self.assertIs(resolve(self.url, urlconf=urlconf).func, message_collection)
+        self.assertIs(resolve('/api/conversations/', urlconf=urlconf).func, conversation_collection)
+        inbox = resolve('/api/conversations/inbox/', urlconf=urlconf).func
+        self.assertEqual(inbox.actions['get'], 'inbox')
+        self.assertFalse(asyncio.iscoroutinefunction(inbox))
+
+
+@override_settings(CHATS_JWT_USER_CACHE_TIMEOUT=60)
+class ClaimsAuthenticationTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.add_messages(3)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.alice)['access']}")
+
+    def user_queries(self, url):
+        """Lookups of a single user row, as authentication does; joins for payloads don't count."""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in context.captured_queries if 'FROM "chats_user" WHERE' in query['sql']]
+
+    def test_tokens_carry_user_claims(self):
+        token = AccessToken(get_tokens_for_user(self.alice)['access'])
+        self.assertEqual((token['username'], token['role']), ('alice', 'guest'))
+
+        response = APIClient().post('/api/token/', {'username': 'alice', 'password': 'pass1234'}, format='json')
+        self.assertEqual(AccessToken(response.data['access'])['username'], 'alice')
+
+    def test_reads_skip_the_user_table_once_cached(self):
+        self.assertEqual(len(self.user_queries(self.messages_url())), 1)
+        self.assertEqual(self.user_queries(self.messages_url()), [])
+        self.assertEqual(self.user_queries('/api/conversations/'), [])
+
+    def test_claims_user_works_for_writes(self):
+        response = self.client.post(self.messages_url(), {'message_body': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sender_username'], 'alice')
+        self.assertEqual(Message.objects.get(pk=response.data['message_id']).sender, self.alice)
+
+    def test_deactivation_revokes_straight_away(self):
+        self.client.get(self.messages_url())
+        self.alice.is_active = False
+        self.alice.save()
+        self.assertEqual(self.client.get(self.messages_url()).status_code, 401)
+
+    def test_tokens_without_claims_fall_back_to_the_database(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.alice)}")
+        self.assertEqual(len(self.user_queries(self.messages_url())), 1)
+
+
+class AuthenticationPolicyTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def basic_auth(self):
+        credentials = base64.b64encode(b'alice:pass1234').decode()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Basic {credentials}")
+
+    def test_records_time_per_authenticator(self):
+        timing_stats.reset()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.alice)['access']}")
+        with self.assertLogs('chats.auth', 'DEBUG'):
+            response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(timing_stats.snapshot()['ClaimsJWTAuthentication']['count'], 1)
+        # Callers only see the timings when the header is turned on.
+        self.assertFalse(response.has_header('Server-Timing'))
+        with override_settings(CHATS_AUTHENTICATION_SERVER_TIMING=True):
+            response = self.client.get(self.messages_url())
+        self.assertRegex(response['Server-Timing'], r'^auth-ClaimsJWTAuthentication;dur=[0-9.]+$')
+
+    def test_api_is_token_only(self):
+        self.client.login(username='alice', password='pass1234')
+        self.assertEqual(self.client.get(self.messages_url()).status_code, 401)
+
+        self.client.logout()
+        self.basic_auth()
+        with patch('rest_framework.authentication.authenticate') as authenticate:
+            self.assertEqual(self.client.get(self.messages_url()).status_code, 401)
+        authenticate.assert_not_called()
+
+    def test_policies_are_configurable(self):
+        timing_stats.reset()
+        policies = {'token': ('rest_framework.authentication.BasicAuthentication',)}
+        with override_settings(CHATS_AUTHENTICATION_POLICIES=policies):
+            self.basic_auth()
+            response = self.client.get(self.messages_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(timing_stats.snapshot()), ['BasicAuthentication'])
+
+
+class RenderingTests(ChatsTestCase):
+
+    def test_fast_renderer_matches_json_renderer(self):
+        self.add_messages(3)
+        data = {
+            'message': MessageSerializer(Message.objects.first()).data,
+            'text': 'café     "quoted"',
+            'when': timezone.now(),
+            'nothing': None,
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_api_responses_use_fast_renderer(self):
+        response = self.client.get(self.messages_url())
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+
+    def test_large_json_is_gzipped(self):
+        ensure_summary(self.conversation)
+        self.add_messages(50)
+        plain = self.client.get(self.messages_url())
+        response = self.client.get(self.messages_url(), HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(len(response.content), len(plain.content))
+        # Weak ETags still revalidate.
+        response = self.client.get(
+            self.messages_url(), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_or_unaccepted_responses_are_not_compressed(self):
+        self.add_messages(50)
+        for url, encoding in (
+            (self.messages_url() + '?page_size=1', 'gzip'),
+            (self.messages_url(), ''),
+            (self.messages_url(), 'gzip;q=0'),
+        ):
+            with self.subTest(url=url, encoding=encoding):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_export_is_gzipped(self):
+        self.add_messages(25)
+        response = self.client.get(self.messages_url() + 'export/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 25)
+
+    def test_streams_flush_by_size_or_time(self):
+        chunks = [b'x' * 10] * 7
+        flushes = lambda size, interval: [flush for _, flush in flush_points(chunks, size, interval)]
+        self.assertEqual(flushes(25, 60), [False, False, True, False, False, True, False])
+        self.assertEqual(flushes(1000, 0), [True] * 7)
+
+        # The gzip header, the two flushes and the end of the stream.
+        parts = list(gzip_stream(iter(chunks), 6, 25, 60))
+        self.assertEqual(len(parts), 4)
+        self.assertEqual(gzip.decompress(b''.join(parts)), b''.join(chunks))
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding('gzip, br', ('br', 'gzip')), 'br')
+        self.assertEqual(choose_encoding('gzip;q=1, br;q=0.5', ('br', 'gzip')), 'gzip')
+        self.assertEqual(choose_encoding('*', ('gzip',)), 'gzip')
+        self.assertEqual(choose_encoding('identity', ('gzip',)), None)
+
+
+class BinaryFormatTests(ChatsTestCase):
+
+    def as_json(self, row):
+        """A decoded binary row in the JSON representation."""
+        return {
+            **row,
+            'message_id': str(uuid.UUID(bytes=row['message_id'])),
+            'conversation': str(uuid.UUID(bytes=row['conversation'])),
+            'sender': str(uuid.UUID(bytes=row['sender'])),
+            'sent_at': JSONRenderer().render(decode_timestamp(row['sent_at'])).decode().strip('"'),
+        }
+
+    def test_codec_round_trip(self):
+        values = [
+            None, True, False, 0, 127, 128, -1, -32, -33, 255, 65536, 2 ** 40, -(2 ** 40), 1.5,
+            '', 'é' * 40, 'x' * 300, 'y' * 70000, b'\x00' * 16, b'z' * 300,
+            list(range(20)), {str(i): i for i in range(20)}, {'nested': [{'a': [1, 2]}]},
+        ]
+        for value in values:
+            with self.subTest(value=repr(value)[:40]):
+                self.assertEqual(unpackb(packb(value)), value)
+        self.assertEqual(packb({'a': 1}), b'\x81\xa1a\x01')
+        self.assertEqual(packb([None, True, -1, 2 ** 16]), b'\x94\xc0\xc3\xff\xce\x00\x01\x00\x00')
+
+    def test_native_values(self):
+        message_id = uuid.uuid4()
+        sent_at = timezone.now()
+        row = unpackb(packb({'id': message_id, 'at': sent_at}))
+        self.assertEqual(row['id'], message_id.bytes)
+        self.assertIsInstance(row['at'], int)
+        self.assertEqual(decode_timestamp(row['at']), sent_at)
+
+    def test_message_list_matches_json(self):
+        self.add_messages(5)
+        url = self.messages_url() + '?page_size=3'
+        expected = self.client.get(url).json()
+
+        for response in (
+            self.client.get(url + '&format=msgpack'),
+            self.client.get(url, HTTP_ACCEPT='application/x-msgpack'),
+        ):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+            page = unpackb(response.content)
+            self.assertEqual([self.as_json(row) for row in page['results']], expected['results'])
+        self.assertIn('format=msgpack', unpackb(self.client.get(url + '&format=msgpack').content)['next'])
+
+    def test_errors_are_encoded_too(self):
+        self.client.force_authenticate(self.eve)
+        response = self.client.get(self.messages_url() + 'export/?format=msgpack')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get(f"/api/conversations/{uuid.uuid4()}/messages/?format=msgpack")
+        self.assertIn('results', unpackb(response.content))
+
+    def test_only_row_actions_offer_the_binary_format(self):
+        [message] = self.add_messages(1)
+        url = f"{self.messages_url()}{message.pk}/"
+        self.assertEqual(self.client.get(url + '?format=msgpack').status_code, 404)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/x-msgpack').status_code, 406)
+        response = self.client.post(self.messages_url(), {'message_body': 'hi'}, format='json',
+                                    HTTP_ACCEPT='application/x-msgpack')
+        self.assertEqual(response.status_code, 406)
+        self.assertFalse(Message.objects.filter(message_body='hi').exists())
+
+    def test_export(self):
+        self.add_messages(25)
+        expected = [
+            json.loads(line) for line in
+            b''.join(self.client.get(self.messages_url() + 'export/').streaming_content).decode().splitlines()
+        ]
+        response = self.client.get(self.messages_url() + 'export/?format=msgpack')
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        rows = list(unpack_stream(b''.join(response.streaming_content)))
+        self.assertEqual([self.as_json(row) for row in rows], expected)
+
+
+class ConversationListCacheTests(ChatsTestCase):
+
+    url = '/api/conversations/'
+
+    def setUp(self):
+        super().setUp()
+        ensure_summary(self.conversation)
+        self.add_messages(3)
+        listcache.stats.reset()
+
+    def get(self, user=None, url=None):
+        self.client.force_authenticate(user or self.alice)
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assertCounters(self, hits, misses):
+        snapshot = listcache.stats.snapshot()
+        self.assertEqual((snapshot['hits'], snapshot['misses']), (hits, misses))
+
+    def test_first_page_is_served_from_cache(self):
+        first = self.get()
+        with CaptureQueriesContext(connection) as context:
+            second = self.get()
+        self.assertEqual(second, first)
+        self.assertCounters(hits=1, misses=1)
+        # Only the conditional GET version is read.
+        self.assertEqual(len(context.captured_queries), 1)
+
+        # Other pages and users are cached separately, or not at all.
+        Conversation.objects.create().participants.set([self.alice, self.eve])
+        self.get(url=self.url + '?page=2&page_size=1')
+        self.get(self.bob)
+        self.assertCounters(hits=1, misses=2)
+
+    def test_new_message_invalidates_participants_only(self):
+        outsider_conversation = Conversation.objects.create()
+        outsider_conversation.participants.set([self.eve, self.bob])
+        for user in (self.alice, self.bob, self.eve):
+            self.get(user)
+
+        self.client.force_authenticate(self.bob)
+        response = self.client.post(self.messages_url(), {'message_body': 'new'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        listcache.stats.reset()
+        self.assertEqual(self.get()['results'][0]['latest_messages'][0]['message_body'], 'new')
+        self.get(self.eve)
+        self.assertCounters(hits=1, misses=1)
+
+    def test_added_participant_invalidates(self):
+        self.get()
+        self.get(self.eve)
+        self.conversation.participants.add(self.eve)
+
+        listcache.stats.reset()
+        alice = self.get()
+        self.assertEqual(len(alice['results'][0]['participants']), 3)
+        self.assertEqual(self.get(self.eve)['count'], 1)
+        self.assertCounters(hits=0, misses=2)
+
+    def test_peer_profile_change_invalidates(self):
+        self.get()
+        self.bob.last_login = timezone.now()
+        self.bob.save(update_fields=['last_login'])
+        self.get()
+        self.assertCounters(hits=1, misses=1)
+
+        self.bob.username = 'robert'
+        self.bob.save()
+        usernames = {user['username'] for user in self.get()['results'][0]['participants']}
+        self.assertIn('robert', usernames)
+        self.assertCounters(hits=1, misses=2)
+
+    @override_settings(CHATS_CONVERSATION_LIST_CACHE_TIMEOUT=0)
+    def test_can_be_disabled(self):
+        self.get()
+        self.get()
+        self.assertCounters(hits=0, misses=0)
+
+
+class MessageSearchTests(ChatsTestCase):
+
+    url = '/api/conversations/search/'
+
+    def setUp(self):
+        super().setUp()
+        self.other = Conversation.objects.create()
+        self.other.participants.set([self.bob, self.eve])
+
+    def post(self, body, conversation=None, sender=None):
+        return Message.objects.create(
+            conversation=conversation or self.conversation, sender=sender or self.bob, message_body=body)
+
+    def search(self, **params):
+        response = self.client.get(f"{self.url}?{urlencode(params)}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def bodies(self, **params):
+        return [row['message_body'] for row in self.search(**params)['results']]
+
+    def test_ranked_and_scoped_to_own_conversations(self):
+        self.post('lunch at the usual place?')
+        self.post('lunch lunch at the place')
+        self.post('dinner')
+        self.post('lunch with eve', conversation=self.other)
+
+        # More occurrences in a body of the same length rank higher.
+        self.assertEqual(self.bodies(q='lunch'), ['lunch lunch at the place', 'lunch at the usual place?'])
+        self.assertEqual(self.bodies(q='LUNCH usual'), ['lunch at the usual place?'])
+        # The last word matches as a prefix; the others don't.
+        self.assertEqual(self.bodies(q='din'), ['dinner'])
+        self.assertEqual(self.bodies(q='din lunch'), [])
+
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(len(self.bodies(q='lunch')), 3)
+        self.assertEqual(len(self.bodies(q='lunch', conversation=self.other.pk)), 1)
+        # Users in many conversations are scoped by a join instead.
+        with patch('chats.search.MAX_INDEXED_SCOPE', 1):
+            self.assertEqual(len(self.bodies(q='lunch')), 3)
+            self.client.force_authenticate(self.eve)
+            self.assertEqual(self.bodies(q='lunch'), ['lunch with eve'])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = self.post('see you at noon')
+        Message.objects.bulk_create([Message(conversation=self.conversation, sender=self.bob, message_body='noon it is')])
+        self.assertEqual(len(self.bodies(q='noon')), 2)
+
+        message.message_body = 'see you at midnight'
+        message.save()
+        self.assertEqual(self.bodies(q='noon'), ['noon it is'])
+        self.assertEqual(self.bodies(q='midnight'), ['see you at midnight'])
+
+        Message.objects.filter(message_body='noon it is').delete()
+        self.assertEqual(self.bodies(q='noon'), [])
+
+    def test_hits_gone_before_the_row_fetch_are_skipped(self):
+        gone, kept = self.post('meet at noon'), self.post('noon works')
+        fetch_rows = Message.objects.filter
+
+        def delete_first(*args, **kwargs):
+            # Deleted (or archived) between the match and the row fetch.
+            Message._base_manager.filter(pk=gone.pk).delete()
+            return fetch_rows(*args, **kwargs)
+
+        with patch.object(Message.objects, 'filter', side_effect=delete_first):
+            self.assertEqual(self.bodies(q='noon'), [kept.message_body])
+
+    def test_keyset_paging(self):
+        for i in range(7):
+            self.post(f"report {i} " + 'report ' * i)
+        seen, page = [], self.search(q='report', page_size=3)
+        while True:
+            seen += [row['message_body'] for row in page['results']]
+            if not page['next']:
+                break
+            response = self.client.get(page['next'])
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, self.bodies(q='report', page_size=10))
+        # Most occurrences first.
+        self.assertTrue(seen[0].startswith('report 6'))
+
+    def test_search_syntax_is_plain_text(self):
+        self.post('is "this" OR that NEAR(x)?')
+        self.assertEqual(len(self.bodies(q='"this" OR')), 1)
+        self.assertEqual(len(self.bodies(q='NEAR(x')), 1)
+
+    def test_bad_requests(self):
+        for params in ({'q': ''}, {'q': '?!'}, {'q': 'a', 'cursor': 'nope'}, {'q': 'a', 'conversation': 'x'}):
+            with self.subTest(params=params):
+                response = self.client.get(f"{self.url}?{urlencode(params)}")
+                self.assertEqual(response.status_code, 400)
+
+
+class MessageFilterTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.messages = self.add_messages(10)
+
+    def filtered(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"{self.messages_url()}?{urlencode(params)}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results'], context.captured_queries
+
+    def test_sender(self):
+        results, queries = self.filtered(sender=self.bob.pk)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(row['sender'] == str(self.bob.pk) for row in results))
+
+        # The sender id is not looked up in the user table...
+        for query in queries:
+            self.assertNotRegex(query['sql'], r'FROM "chats_user"')
+        # ...but compared with the foreign key column, in every message query.
+        message_queries = [query['sql'] for query in queries if 'FROM "chats_message"' in query['sql']]
+        self.assertTrue(message_queries)
+        for sql in message_queries:
+            self.assertIn('"chats_message"."sender_id" = ', sql)
+
+        self.assertEqual(self.filtered(sender=self.eve.pk)[0], [])
+
+    def test_conversation(self):
+        self.assertEqual(len(self.filtered(conversation=self.conversation.pk)[0]), 10)
+        self.assertEqual(self.filtered(conversation=Conversation.objects.create().pk)[0], [])
+
+    def test_sent_at_range_is_inclusive(self):
+        first, last = self.messages[2].sent_at, self.messages[5].sent_at
+        results, queries = self.filtered(sent_at_after=first.isoformat(), sent_at_before=last.isoformat())
+        self.assertEqual([row['message_body'] for row in results], [f"message {i}" for i in (5, 4, 3, 2)])
+        for sql in [query['sql'] for query in queries if 'FROM "chats_message"' in query['sql']]:
+            self.assertIn('"chats_message"."sent_at" BETWEEN ', sql)
+
+    def test_combined_with_cursor_pages(self):
+        response = self.client.get(f"{self.messages_url()}?{urlencode({'sender': self.alice.pk, 'page_size': 2})}")
+        data = response.json()
+        seen = [row['message_body'] for row in data['results']]
+        seen += [row['message_body'] for row in self.client.get(data['next']).json()['results']]
+        self.assertEqual(seen, [f"message {i}" for i in (9, 7, 5, 3)])
+
+    def test_invalid_values(self):
+        for field, params in (
+            ('sender', {'sender': 'alice'}),
+            ('conversation', {'conversation': '42'}),
+            ('sent_at', {'sent_at_after': 'yesterday'}),
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(f"{self.messages_url()}?{urlencode(params)}")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.json())
+
+
+class DatabaseProfileTests(TestCase):
+
+    def scratch_connections(self, directory):
+        return ConnectionHandler({'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, 'scratch.sqlite3'),
+        }})
+
+    def pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_new_connections_get_the_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(TESTING=False):
+            scratch = self.scratch_connections(directory)['default']
+            try:
+                self.assertEqual(self.pragma(scratch, 'journal_mode'), 'wal')
+                self.assertEqual(self.pragma(scratch, 'synchronous'), 1)  # NORMAL
+                self.assertEqual(self.pragma(scratch, 'busy_timeout'), 5000)
+                self.assertEqual(self.pragma(scratch, 'cache_size'), -20000)
+            finally:
+                scratch.close()
+
+    def test_test_runs_leave_database_files_alone(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scratch = self.scratch_connections(directory)['default']
+            try:
+                self.assertEqual(self.pragma(scratch, 'journal_mode'), 'delete')
+            finally:
+                scratch.close()
+
+    def test_broken_connections_are_dropped_before_a_request(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scratch = self.scratch_connections(directory)
+            scratch['default'].ensure_connection()
+            with patch('chats.db.connections', scratch):
+                request_started.send(sender=None)
+                self.assertIsNotNone(scratch['default'].connection)
+
+                with patch.object(scratch['default'], 'is_usable', return_value=False):
+                    with override_settings(CHATS_CONN_HEALTH_CHECKS=False):
+                        request_started.send(sender=None)
+                    self.assertIsNotNone(scratch['default'].connection)
+                    request_started.send(sender=None)
+                self.assertIsNone(scratch['default'].connection)
+
+
+@override_settings(CHATS_READ_REPLICA='replica', CHATS_READ_YOUR_WRITES_WINDOW=10)
+class ReplicaRoutingTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        listcache.stats.reset()
+        self.add_messages(3)
+        # A mirror connection cannot see the test transaction, so the replica
+        # alias shares the default connection and routing is observed on the
+        # router instead.
+        mirror = connections['replica']
+        connections['replica'] = connections['default']
+        self.addCleanup(connections.__setitem__, 'replica', mirror)
+
+    def replica_reads(self, method, url, data=None):
+        """How many reads `url` sent to the replica."""
+        routed = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = db_for_read(router, model, **hints)
+            routed.append(alias)
+            return alias
+
+        with patch.object(ReplicaRouter, 'db_for_read', spy):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 400)
+        return routed.count('replica')
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Message))
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Message), 'replica')
+            self.assertEqual(router.db_for_read(Conversation), 'replica')
+            self.assertIsNone(router.db_for_read(Session))
+            self.assertEqual(router.db_for_write(Message), 'default')
+            with override_settings(CHATS_READ_REPLICA=None):
+                self.assertIsNone(router.db_for_read(Message))
+        self.assertFalse(router.allow_migrate('replica', 'chats'))
+
+        # Writes go back to the primary only for rows read from the replica.
+        self.assertIsNone(router.db_for_write(Session))
+        message = Message(conversation=self.conversation, sender=self.alice)
+        for alias, expected in (('replica', 'default'), ('default', 'default'), ('other', 'other')):
+            message._state.db = alias
+            self.assertEqual(router.db_for_write(Message, instance=message), expected)
+
+    def test_list_and_retrieve_read_from_the_replica(self):
+        message = Message.objects.filter(conversation=self.conversation).first()
+        for url in ('/api/conversations/', f'/api/conversations/{self.conversation.pk}/',
+                    self.messages_url(), f'{self.messages_url()}{message.pk}/'):
+            with self.subTest(url=url):
+                self.assertGreater(self.replica_reads('get', url), 0)
+
+        # Other actions stay on the primary.
+        self.assertEqual(self.replica_reads('get', '/api/conversations/inbox/'), 0)
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        self.assertEqual(self.replica_reads('post', self.messages_url(), {'message_body': "hello"}), 0)
+        self.assertEqual(self.replica_reads('get', self.messages_url()), 0)
+
+        # Only the writer is pinned.
+        self.client.force_authenticate(self.bob)
+        self.assertGreater(self.replica_reads('get', self.messages_url()), 0)
+
+    def test_replica_pages_are_not_cached(self):
+        self.replica_reads('get', '/api/conversations/')
+        self.assertGreater(self.replica_reads('get', '/api/conversations/'), 0)
+        self.assertEqual(listcache.stats.snapshot()['hits'], 0)
+
+    def test_replicate_copies_the_primary(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scratch = ConnectionHandler({
+                alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, f'{alias}.sqlite3')}
+                for alias in ('default', 'replica')
+            })
+            try:
+                with scratch['default'].cursor() as cursor:
+                    cursor.execute("CREATE TABLE note (body TEXT)")
+                    cursor.execute("INSERT INTO note VALUES ('replicated')")
+                replicate_sqlite(scratch['default'], scratch['replica'])
+                with scratch['replica'].cursor() as cursor:
+                    cursor.execute("SELECT body FROM note")
+                    self.assertEqual(cursor.fetchall(), [('replicated',)])
+            finally:
+                scratch.close_all()
+
+
+@override_settings(CHATS_ARCHIVE_AFTER_DAYS=30)
+class MessageArchiveTests(ChatsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        ensure_summary(self.conversation)
+        start = timezone.now() - timedelta(days=60)
+        self.messages = Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.alice if i % 2 else self.bob,
+                    message_body=f"message {i}", sent_at=start + timedelta(days=i))
+            for i in range(50)
+        ])
+        record_messages(self.conversation, self.messages)
+        # Sent more than 30 days ago, and not among the newest that stay hot.
+        self.cold = [
+            message for message in self.messages[:-HOT_MESSAGES_PER_CONVERSATION]
+            if message.sent_at < archive_cutoff()
+        ]
+
+    def archive(self, **kwargs):
+        return sum(archive_messages(**kwargs))
+
+    def walk(self, url):
+        """Message ids over every page of `url`, following the next links."""
+        ids = []
+        while url:
+            body = self.client.get(url).json()
+            ids += [row['message_id'] for row in body['results']]
+            url = body['next']
+        return ids
+
+    def test_old_messages_move_in_resumable_batches(self):
+        self.assertEqual(self.archive(batch_size=7, max_batches=2), 14)
+        self.assertEqual(self.archive(batch_size=7), len(self.cold) - 14)
+        self.assertEqual(self.archive(), 0)
+
+        archived = set(ArchivedMessage.objects.values_list('pk', flat=True))
+        self.assertEqual(archived, {message.pk for message in self.cold})
+        self.assertFalse(Message.objects.filter(pk__in=archived).exists())
+        self.assertEqual(ArchivedMessage.objects.get(pk=self.cold[0].pk).message_body, self.cold[0].message_body)
+
+    def test_latest_messages_of_a_conversation_stay_hot(self):
+        quiet = Conversation.objects.create()
+        quiet.participants.set([self.alice, self.bob])
+        start = timezone.now() - timedelta(days=90)
+        old = Message.objects.bulk_create([
+            Message(conversation=quiet, sender=self.alice, message_body=f"old {i}", sent_at=start + timedelta(hours=i))
+            for i in range(HOT_MESSAGES_PER_CONVERSATION + 5)
+        ])
+        record_messages(quiet, old)
+        url = f"/api/conversations/{quiet.pk}/?preview_size={HOT_MESSAGES_PER_CONVERSATION}"
+        before = self.client.get(url)
+
+        self.archive()
+        self.assertEqual(set(Message.objects.filter(conversation=quiet)), set(old[5:]))
+        # The preview and its validators are unchanged, so a 304 stays right.
+        after = self.client.get(url)
+        self.assertEqual(after.json(), before.json())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag']).status_code, 304)
+
+    def test_history_reads_through_to_the_archive(self):
+        url = f"{self.messages_url()}?page_size=7"
+        before = self.walk(url)
+        self.archive()
+        self.assertEqual(self.walk(url), before)
+        self.assertEqual(self.client.get(url).json()['count'], 50)
+
+        # A full first page never touches the archive.
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(f"{self.messages_url()}?page_size=5&skip_count=true")
+        self.assertFalse([q for q in context.captured_queries if 'chats_archivedmessage' in q['sql']])
+
+    def test_previous_links_cross_back_from_the_archive(self):
+        self.archive()
+        first = self.client.get(f"{self.messages_url()}?page_size=15").json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+    def test_page_numbers_cover_the_archive(self):
+        pages = lambda: [
+            row['message_id'] for page in (1, 2, 3) for row in
+            self.client.get(f"{self.messages_url()}?page={page}&page_size=20").json()['results']
+        ]
+        before = pages()
+        self.archive()
+        self.assertEqual(pages(), before)
+        ascending = self.client.get(f"{self.messages_url()}?page=1&page_size=3&ordering=sent_at").json()
+        self.assertEqual([row['message_id'] for row in ascending['results']],
+                         [str(message.pk) for message in self.messages[:3]])
+
+    def test_archived_messages_are_read_only(self):
+        self.archive()
+        url = f"{self.messages_url()}{self.cold[0].pk}/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message_body'], self.cold[0].message_body)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.client.force_authenticate(self.eve)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_counts_and_exports_include_the_archive(self):
+        version = conversation_version(self.conversation.pk)
+        self.archive()
+        self.assertEqual(conversation_version(self.conversation.pk), version)
+
+        conversations = self.client.get('/api/conversations/').json()['results']
+        self.assertEqual(conversations[0]['message_count'], 50)
+        rebuild_summaries()
+        self.assertEqual(ConversationSummary.objects.get(pk=self.conversation.pk).message_count, 50)
+
+        export = self.client.get(f"{self.messages_url()}export/")
+        rows = [json.loads(line) for line in b''.join(export.streaming_content).splitlines()]
+        self.assertEqual([row['message_id'] for row in rows], [str(message.pk) for message in self.messages])
+
+    def test_messages_cannot_be_backdated_into_the_archive(self):
+        self.archive()
+        url = self.messages_url()
+        backdated = (timezone.now() - timedelta(days=600)).isoformat()
+        before = self.walk(url)
+
+        response = self.client.post(f"{url}bulk/", {'messages': [
+            {'message_body': "recent"}, {'message_body': "backdated", 'sent_at': backdated},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertIn('sent_at', response.data['results'][1]['errors'])
+
+        response = self.client.post(url, {'message_body': "backdated", 'sent_at': backdated}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sent_at', response.data)
+
+        hot = Message.objects.filter(conversation=self.conversation).latest('sent_at')
+        response = self.client.patch(f"{url}{hot.pk}/", {'sent_at': backdated}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # The archive bounds writes even when it was filled with a shorter
+        # cutoff than the current one, or archiving is now off.
+        with override_settings(CHATS_ARCHIVE_AFTER_DAYS=None):
+            newest_archived = ArchivedMessage.objects.latest('sent_at').sent_at
+            response = self.client.post(url, {'message_body': "x", 'sent_at': newest_archived.isoformat()},
+                                        format='json')
+            self.assertEqual(response.status_code, 400)
+
+        after = self.walk(url)
+        self.assertEqual(after[1:], before)
+        self.assertEqual(len(after), 51)
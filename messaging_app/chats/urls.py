@@ -1,6 +1,9 @@
 from rest_framework_nested.routers import DefaultRouter, NestedDefaultRouter
 from django.urls import path, include
-from .views import ConversationViewSet, MessageViewSet
+from .views import (
+    ConversationViewSet, MessageViewSet, messages_since,
+    conversation_collection, conversation_detail, message_collection, message_detail,
+)
 
 # Create base router for conversations
 router = DefaultRouter()
@@ -11,7 +14,20 @@ nested_router = NestedDefaultRouter(router, r'conversations', lookup='conversati
 nested_router.register(r'messages', MessageViewSet, basename='conversation-messages')
 
 urlpatterns = [
+    # Ahead of the routers so "since" is not taken for a message id.
+    path('conversations/<uuid:conversation_pk>/messages/since/', messages_since,
+         name='conversation-messages-since'),
     path('', include(router.urls)),
     path('', include(nested_router.urls)),
 ]
 
+
+# Served under ASGI (see messaging_app.asgi) ahead of urlpatterns. Ids are
+# matched as UUIDs so extra actions such as inbox/ and export/ still fall
+# through to the routers.
+async_urlpatterns = [
+    path('conversations/', conversation_collection),
+    path('conversations/<uuid:pk>/', conversation_detail),
+    path('conversations/<uuid:conversation_pk>/messages/', message_collection),
+    path('conversations/<uuid:conversation_pk>/messages/<uuid:pk>/', message_detail),
+]
@@ -1,30 +1,130 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import update_wrapper
+from itertools import chain, islice
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+
 from rest_framework import viewsets, status, filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.generics import get_object_or_404
+from rest_framework.request import Request
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from .archive import ArchivedHistory, earliest_writable
+from .binary import packb
+from .models import ArchivedMessage, Conversation, Message, ParticipantSummary
+from .serializers import (
+    ConversationSerializer, ConversationListSerializer, InboxSerializer, MessageSerializer,
+    BulkMessageSerializer, ConversationRowSerializer, MessageNativeRowSerializer, MessageRowSerializer,
+    MESSAGE_ROW_FIELDS, message_row_to_dict, message_row_to_native,
+)
+from .renderers import MessagePackRenderer
+from .summaries import (
+    conversation_version, ensure_summary, mark_read, record_message, record_messages,
+    refresh_summary, touch_summary, user_conversations_version,
+)
+from .auth import AuthenticationPolicyMixin, get_authenticators
+from .conditional import ConditionalGetMixin
+from .filters import MessageFilter
+from .listcache import CachedFirstPageMixin
+from .routers import ReplicaReadMixin
+from .search import search_available, search_messages
+from .realtime import conversation_channel, get_broker, publish_messages
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .permissions import IsParticipantOfConversation
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .permissions import IsParticipantOfConversation, is_participant
 from django_filters.rest_framework import DjangoFilterBackend
-from .filters import MessageFilter
+from .pagination import (
+    CustomMessagePagination, MessageCursorPagination, decode_message_cursor, encode_message_cursor,
+)
 
 User = get_user_model()
 
-class ConversationViewSet(viewsets.ModelViewSet):
+LONG_POLL_TIMEOUT = 25
+MAX_LONG_POLL_TIMEOUT = 60
+LONG_POLL_PAGE_SIZE = 100
+
+
+def participant_messages(user, conversation_id=None, model=Message):
+    # Only messages from conversations the user is part of
+    queryset = model.objects.filter(conversation__participants=user)
+    if conversation_id is not None:
+        queryset = queryset.filter(conversation_id=conversation_id)
+    return queryset
+
+
+def participant_conversation_version(request, conversation_id):
+    # Validators are only handed out to participants, so a 304 never
+    # confirms anything to outsiders.
+    try:
+        if conversation_id is None or not is_participant(request, conversation_id):
+            return None
+    except ValidationError:
+        return None
+    return conversation_version(conversation_id)
+
+
+class ConversationViewSet(AuthenticationPolicyMixin, ReplicaReadMixin, ConditionalGetMixin, CachedFirstPageMixin,
+                          viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
+    authentication_policy = 'token'
     permission_classes = [IsAuthenticated, IsParticipantOfConversation]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_class = MessageFilter
-    ordering = ['-sent_at']
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
     pagination_class = CustomMessagePagination
+    # Render GET lists from .values() rows instead of model serializers.
+    use_fast_serializers = True
+    search_page_size = 20
+    max_search_page_size = 100
+    # Represented with a bounded preview of the latest messages; the full
+    # history is paged through the nested messages route.
+    preview_actions = ('list', 'retrieve', 'update', 'partial_update')
 
     def get_queryset(self):
         # Only show conversations the user is part of
-        return Conversation.objects.filter(participants=self.request.user).distinct()
+        queryset = Conversation.objects.filter(participants=self.request.user).distinct()
+        if self.action in self.preview_actions:
+            hot, archived = (
+                model.objects
+                .filter(conversation=OuterRef('pk'))
+                .order_by()
+                .values('conversation')
+                .annotate(total=Count('*'))
+                .values('total')
+                for model in (Message, ArchivedMessage)
+            )
+            queryset = queryset.annotate(
+                message_count=Coalesce(Subquery(hot), 0) + Coalesce(Subquery(archived), 0))
+        return self.get_serializer_class().setup_eager_loading(queryset)
+
+    def get_serializer_class(self):
+        if self.action == 'list' and self.use_fast_serializers and self.request.method == 'GET':
+            return ConversationRowSerializer
+        if self.action in self.preview_actions:
+            return ConversationListSerializer
+        return super().get_serializer_class()
+
+    def get_conditional_state(self):
+        if self.action == 'list':
+            return user_conversations_version(self.request.user)
+        return participant_conversation_version(self.request, self.kwargs.get('pk'))
 
     def create(self, request, *args, **kwargs):
         participant_ids = request.data.get('participants', [])
-        participant_ids = list(set(participant_ids + [request.user.id]))  # Ensure requester is included
+        participant_ids = list({str(pk) for pk in participant_ids} | {str(request.user.pk)})  # Ensure requester is included
 
         if len(participant_ids) < 2:
             return Response(
@@ -32,48 +132,414 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        participants = User.objects.filter(id__in=participant_ids)
-        if participants.count() != len(participant_ids):
+        try:
+            participants = list(User.objects.filter(pk__in=participant_ids))
+        except ValidationError:
+            participants = []
+        if len(participants) != len(participant_ids):
             return Response(
                 {"error": "One or more participant IDs are invalid."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        conversation = Conversation.objects.create()
-        conversation.participants.set(participants)
+        with transaction.atomic():
+            conversation = Conversation.objects.create()
+            conversation.participants.set(participants)
+            ensure_summary(conversation)
         serializer = self.get_serializer(conversation)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class MessageViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """The user's conversations by latest activity, read from the summary tables only."""
+        queryset = (
+            ParticipantSummary.objects
+            .filter(user=request.user)
+            .select_related('summary')
+            .order_by(F('summary__last_sent_at').desc(nulls_last=True), '-summary_id')
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = InboxSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over the messages of the user's conversations, best
+        match first: ?q=<words>, optionally &conversation=<id>, paged with
+        ?cursor= from the previous page's "next" link. See chats.search.
+        """
+        if not search_available():
+            return Response({"error": "Search is not available on this database."},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        params = request.query_params
+        try:
+            conversation_id = params.get('conversation')
+            conversation_id = Conversation._meta.pk.to_python(conversation_id) if conversation_id else None
+        except ValidationError:
+            return Response({"error": "Invalid conversation ID."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page_size = min(int(params.get('page_size', self.search_page_size)), self.max_search_page_size)
+            rows, cursor = search_messages(
+                request.user, params.get('q', ''), max(page_size, 1),
+                after=params.get('cursor'), conversation_id=conversation_id,
+            )
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'next': replace_query_param(request.build_absolute_uri(), 'cursor', cursor) if cursor else None,
+            'results': [message_row_to_dict(row) for row in rows],
+        })
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        conversation = self.get_object()
+        mark_read(conversation, request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class MessageViewSet(AuthenticationPolicyMixin, ReplicaReadMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
+    authentication_policy = 'token'
     permission_classes = [IsAuthenticated,IsParticipantOfConversation]
-    filter_backends = [filters.OrderingFilter]
+    # ?format=msgpack or Accept: application/x-msgpack for the binary format,
+    # offered by the actions that render native rows.
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, MessagePackRenderer]
+    binary_actions = ('list', 'export')
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_class = MessageFilter
+    ordering_fields = ['sent_at']
     ordering = ['-sent_at']
+    pagination_class = MessageCursorPagination
+    max_bulk_size = 500
+    use_fast_serializers = True
+    export_chunk_size = 2000
+
+    @property
+    def paginator(self):
+        # Page-number clients (?page=N) keep the offset paginator; everyone
+        # else scrolls the history with keyset cursors.
+        if not hasattr(self, '_paginator'):
+            if 'page' in self.request.query_params:
+                self._paginator = CustomMessagePagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action in self.binary_actions:
+            return renderers
+        return [renderer for renderer in renderers if not isinstance(renderer, MessagePackRenderer)]
+
+    def get_serializer_class(self):
+        if self.action == 'list' and self.use_fast_serializers and self.request.method == 'GET':
+            if self.is_binary():
+                return MessageNativeRowSerializer
+            return MessageRowSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
-        # Only messages from conversations the user is part of
-        return Message.objects.filter(conversation__participants=self.request.user)
+        queryset = participant_messages(self.request.user, self.kwargs.get('conversation_pk'))
+        return self.get_serializer_class().setup_eager_loading(queryset)
 
-    def create(self, request, *args, **kwargs):
-        data = request.data.copy()
-        data['sender'] = request.user.id
+    def get_archive_queryset(self):
+        """The archived part of the history list (chats.archive), filtered like the rest."""
+        queryset = participant_messages(self.request.user, self.kwargs.get('conversation_pk'), ArchivedMessage)
+        queryset = self.filterset_class(self.request.query_params, queryset=queryset, request=self.request).qs
+        return self.get_serializer_class().setup_eager_loading(queryset)
 
-        # Ensure the user is a participant in the conversation
-        conversation_id = data.get('conversation')
+    def paginate_queryset(self, queryset):
+        # MessageCursorPagination reads the archive itself.
+        if isinstance(self.paginator, CustomMessagePagination):
+            queryset = ArchivedHistory(queryset, self.get_archive_queryset())
+        return super().paginate_queryset(queryset)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+        # Archived messages can be read, not changed.
+        queryset = participant_messages(self.request.user, self.kwargs.get('conversation_pk'), ArchivedMessage)
+        message = get_object_or_404(self.get_serializer_class().setup_eager_loading(queryset), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, message)
+        return message
+
+    def get_conditional_state(self):
+        return participant_conversation_version(self.request, self.kwargs.get('conversation_pk'))
+
+    def is_binary(self):
+        return isinstance(getattr(self.request, 'accepted_renderer', None), MessagePackRenderer)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super().perform_update(serializer)
+            if 'sent_at' in serializer.validated_data:
+                # The edited message may now be, or no longer be, the last one.
+                refresh_summary(serializer.instance.conversation_id)
+            else:
+                touch_summary(serializer.instance.conversation_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            refresh_summary(instance.conversation_id)
+
+    def check_conversation_access(self, request, conversation_id):
+        """Return an error Response unless the user may post to the conversation."""
         if not conversation_id:
             return Response({"error": "Conversation ID is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
-        except Conversation.DoesNotExist:
+            participant = is_participant(request, conversation_id)
+            exists = participant or Conversation.objects.filter(conversation_id=conversation_id).exists()
+        except ValidationError:
+            exists = False
+        if not exists:
             return Response({"error": "Conversation does not exist."}, status=status.HTTP_404_NOT_FOUND)
 
-        if request.user not in conversation.participants.all():
+        if not participant:
             return Response({"error": "You are not a participant in this conversation."},
                             status=status.HTTP_403_FORBIDDEN)
+        return None
+
+    def create(self, request, *args, **kwargs):
+        # Ensure the user is a participant in the conversation
+        conversation_id = self.kwargs.get('conversation_pk') or request.data.get('conversation')
+        error = self.check_conversation_access(request, conversation_id)
+        if error:
+            return error
 
-        serializer = self.get_serializer(data=data)
+        context = {**self.get_serializer_context(), 'conversation_id': conversation_id}
+        serializer = self.get_serializer(data=request.data, context=context)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        with transaction.atomic():
+            message = serializer.save(sender=request.user, conversation_id=conversation_id)
+            record_message(message)
+            data = serializer.data
+            transaction.on_commit(lambda: publish_messages(message.conversation_id, [data]))
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request, conversation_pk=None):
+        """
+        Stream the whole conversation, oldest first, as newline-delimited
+        JSON, or as a sequence of MessagePack maps in the binary format.
+        Rows are read and rendered export_chunk_size at a time, one body
+        chunk per batch, so memory use does not grow with the length of the
+        conversation and compression and ASGI see a few large chunks.
+        """
+        error = self.check_conversation_access(request, conversation_pk)
+        if error:
+            return error
+
+        rows = chain.from_iterable(
+            queryset
+            .order_by('sent_at', 'message_id')
+            .values(*MESSAGE_ROW_FIELDS)
+            .iterator(chunk_size=self.export_chunk_size)
+            # Archived messages are the oldest ones.
+            for queryset in (
+                participant_messages(request.user, conversation_pk, ArchivedMessage),
+                self.get_queryset(),
+            )
+        )
+        batches = iter(lambda: list(islice(rows, self.export_chunk_size)), [])
+        if self.is_binary():
+            chunks = (b''.join(packb(message_row_to_native(row)) for row in batch) for batch in batches)
+            content_type, extension = MessagePackRenderer.media_type, 'msgpack'
+        else:
+            chunks = (''.join(json.dumps(message_row_to_dict(row)) + '\n' for row in batch) for batch in batches)
+            content_type, extension = 'application/x-ndjson', 'ndjson'
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="conversation-{conversation_pk}.{extension}"'
+        return response
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, conversation_pk=None):
+        """
+        Post a batch of messages: {"messages": [{"message_body": ...}, ...]}.
+
+        Membership is checked once and every valid item is written with a
+        single bulk_create. Each item gets its own result; the response is
+        201 when all were created, 207 when some were rejected and 400 when
+        none were.
+        """
+        error = self.check_conversation_access(request, conversation_pk)
+        if error:
+            return error
+
+        items = request.data.get('messages') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Expected a non-empty list of messages."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_bulk_size:
+            return Response({"error": f"At most {self.max_bulk_size} messages per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        conversation = Conversation(conversation_id=Conversation._meta.pk.to_python(conversation_pk))
+        results, messages = [], []
+        context = {'writable_from': earliest_writable(conversation.pk)}
+        for index, item in enumerate(items):
+            serializer = BulkMessageSerializer(data=item, context=context)
+            if serializer.is_valid():
+                message = Message(conversation=conversation, sender=request.user, **serializer.validated_data)
+                messages.append(message)
+                results.append({'index': index, 'status': 'created', 'message_id': message.message_id})
+            else:
+                results.append({'index': index, 'status': 'rejected', 'errors': serializer.errors})
+
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            record_messages(conversation, messages)
+            if messages:
+                data = MessageSerializer(messages, many=True).data
+                transaction.on_commit(lambda: publish_messages(conversation.pk, data))
+
+        if len(messages) == len(items):
+            code = status.HTTP_201_CREATED
+        elif messages:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({'created': len(messages), 'results': results}, status=code)
+
+
+def authenticate(request):
+    """Run the messages API's authenticators on a plain Django request."""
+    drf_request = Request(request, authenticators=get_authenticators(MessageViewSet.authentication_policy))
+    try:
+        return drf_request.user
+    except APIException:
+        return None
+
+
+def fetch_since(user, conversation_id, since, limit):
+    queryset = participant_messages(user, conversation_id)
+    if since is not None:
+        sent_at, message_id = since
+        queryset = queryset.filter(
+            Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id),
+            sent_at__gte=sent_at,
+        )
+    rows = list(queryset.order_by('sent_at', 'message_id').values(*MESSAGE_ROW_FIELDS)[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def latest_cursor(user, conversation_id):
+    row = participant_messages(user, conversation_id).order_by('-sent_at', '-message_id').values(
+        'sent_at', 'message_id').first()
+    return encode_message_cursor(row) if row else None
+
+
+async def messages_since(request, conversation_pk):
+    """
+    Long poll: GET conversations/<id>/messages/since/?cursor=...&timeout=...
+
+    Returns the messages newer than the cursor, oldest first. When there are
+    none yet, the request waits on the realtime broker (without holding a
+    worker thread) until something is published to the conversation or the
+    timeout expires. Without a cursor it returns the cursor of the latest
+    message straight away, as the starting point for the next poll.
+    """
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    user = await sync_to_async(authenticate)(request)
+    if user is None or not user.is_authenticated:
+        return JsonResponse({"error": "Authentication credentials were not provided."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    fake_request = SimpleNamespace(user=user)
+    if not await sync_to_async(is_participant)(fake_request, conversation_pk):
+        return JsonResponse({"error": "You are not a participant in this conversation."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+    cursor = request.GET.get('cursor')
+    if not cursor:
+        return JsonResponse({'results': [], 'cursor': await sync_to_async(latest_cursor)(user, conversation_pk),
+                             'has_more': False})
+    try:
+        since = decode_message_cursor(cursor)
+        timeout = min(float(request.GET.get('timeout', LONG_POLL_TIMEOUT)), MAX_LONG_POLL_TIMEOUT)
+    except (NotFound, ValueError):
+        return JsonResponse({"error": "Invalid cursor or timeout."}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Subscribe before looking, so a message committed in between still wakes us.
+    subscription = get_broker().subscribe(conversation_channel(conversation_pk))
+    try:
+        rows, has_more = await sync_to_async(fetch_since)(user, conversation_pk, since, LONG_POLL_PAGE_SIZE)
+        if not rows:
+            try:
+                await asyncio.wait_for(subscription.get(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            else:
+                rows, has_more = await sync_to_async(fetch_since)(user, conversation_pk, since, LONG_POLL_PAGE_SIZE)
+    finally:
+        subscription.close()
+
+    return JsonResponse({
+        'results': [message_row_to_dict(row) for row in rows],
+        'cursor': encode_message_cursor(rows[-1]) if rows else cursor,
+        'has_more': has_more,
+    })
+
+
+_view_executor = None
+_view_executor_lock = threading.Lock()
+
+
+def get_view_executor():
+    # The loop's default executor is sized from the CPU count, far below
+    # the number of requests that can be waiting on the database.
+    global _view_executor
+    with _view_executor_lock:
+        if _view_executor is None:
+            _view_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'CHATS_ASYNC_VIEW_THREADS', 32),
+                thread_name_prefix='chats-async-view',
+            )
+        return _view_executor
+
+
+def async_viewset_view(viewset, actions):
+    """
+    Serve `actions` of a viewset from an async view under ASGI.
+
+    Django 3.2 has no async ORM, and under ASGI it runs every sync view on a
+    single shared thread, so concurrent API requests queue behind each other.
+    This view hands the viewset to a pool of CHATS_ASYNC_VIEW_THREADS
+    threads instead: each in-flight request gets its own thread and database
+    connection, and the event loop stays free. Connections are released
+    according to CONN_MAX_AGE once the response is rendered.
+    """
+    view = viewset.as_view(actions)
+
+    def run(request, *args, **kwargs):
+        try:
+            response = view(request, *args, **kwargs)
+            # Render here too, rather than on Django's shared thread.
+            if callable(getattr(response, 'render', None)):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(run, thread_sensitive=False, executor=get_view_executor())(
+            request, *args, **kwargs)
+
+    # Keeps csrf_exempt, cls and actions from the DRF view; csrf_exempt()
+    # itself would wrap the coroutine function in a sync one.
+    return update_wrapper(async_view, view)
+
+
+DETAIL_ACTIONS = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
 
+conversation_collection = async_viewset_view(ConversationViewSet, {'get': 'list', 'post': 'create'})
+conversation_detail = async_viewset_view(ConversationViewSet, DETAIL_ACTIONS)
+message_collection = async_viewset_view(MessageViewSet, {'get': 'list', 'post': 'create'})
+message_detail = async_viewset_view(MessageViewSet, DETAIL_ACTIONS)
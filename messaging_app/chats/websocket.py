@@ -0,0 +1,101 @@
+# chats/websocket.py
+"""
+ASGI WebSocket endpoint: ws/conversations/<conversation_id>/
+
+Clients authenticate with a JWT access token, either as ?token=... or an
+"Authorization: Bearer ..." header, and then receive every message
+committed to the conversation as a JSON text frame.
+"""
+
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Conversation
+from .realtime import conversation_channel, get_broker
+
+PATH = re.compile(r'^/ws/conversations/(?P<conversation_id>[0-9a-fA-F-]{32,36})/?$')
+
+# Close codes in the 4000-4999 range are free for applications.
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+
+
+def get_token(scope):
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0] in jwt_settings.AUTH_HEADER_TYPES:
+                return parts[1]
+    return None
+
+
+def get_user_id(scope):
+    token = get_token(scope)
+    if token is None:
+        return None
+    try:
+        return AccessToken(token)[jwt_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+@sync_to_async
+def may_subscribe(user_id, conversation_id):
+    return Conversation.participants.through.objects.filter(
+        conversation_id=conversation_id, user_id=user_id, user__is_active=True,
+    ).exists()
+
+
+async def websocket_application(scope, receive, send):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    conversation_id = match.group('conversation_id').replace('-', '').lower()
+
+    user_id = get_user_id(scope)
+    if user_id is None or not await may_subscribe(user_id, conversation_id):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    subscription = get_broker().subscribe(conversation_channel(conversation_id))
+    await send({'type': 'websocket.accept'})
+    try:
+        await pump(subscription, receive, send)
+    finally:
+        subscription.close()
+
+
+async def pump(subscription, receive, send):
+    """Forward published messages until the client goes away."""
+    incoming = asyncio.ensure_future(receive())
+    outgoing = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait({incoming, outgoing}, return_when=asyncio.FIRST_COMPLETED)
+            if outgoing in done:
+                await send({'type': 'websocket.send', 'text': json.dumps(outgoing.result(), cls=DjangoJSONEncoder)})
+                outgoing = asyncio.ensure_future(subscription.get())
+            if incoming in done:
+                if incoming.result()['type'] == 'websocket.disconnect':
+                    return
+                # Clients have nothing to say on this socket; ignore frames.
+                incoming = asyncio.ensure_future(receive())
+    finally:
+        incoming.cancel()
+        outgoing.cancel()
@@ -9,8 +9,65 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
 
-application = get_asgi_application()
+
+class AsyncRoutesASGIHandler(ASGIHandler):
+    """ASGIHandler that resolves requests against the async-aware URLconf."""
+
+    urlconf = 'messaging_app.asgi_urls'
+
+    async def get_response_async(self, request):
+        request.urlconf = self.urlconf
+        return await super().get_response_async(request)
+
+    async def send_response(self, response, send):
+        """
+        Django 3.2 iterates streaming content on the event loop, where the
+        lazy querysets behind e.g. the message export may not run. Pull each
+        part on the request's sync thread instead, where sync views and
+        response.close() run too.
+        """
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode('ascii') if isinstance(header, str) else header,
+             value.encode('latin1') if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers += [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        parts, done = iter(response), object()
+        next_part = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await next_part(parts, done)
+            if part is done:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+# What get_asgi_application() does, with the handler above.
+django.setup(set_prefix=False)
+django_application = AsyncRoutesASGIHandler()
+
+# Imported after Django is set up, since it touches models and settings.
+from chats.websocket import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,16 @@
+"""
+URL configuration used by the ASGI deployment.
+
+The same API as messaging_app.urls, with the chats list/retrieve/create
+routes answered by async views.
+"""
+from django.urls import include, path
+
+from chats.urls import async_urlpatterns
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('api/', include(async_urlpatterns)),
+    *wsgi_urlpatterns,
+]
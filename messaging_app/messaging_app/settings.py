@@ -10,11 +10,15 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Running under `manage.py test` or pytest.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
@@ -40,12 +44,13 @@ INSTALLED_APPS = [
     'rest_framework',
     'chats',
     'rest_framework_simplejwt',
-    'rest_framework.authentication.BasicAuthentication',
     'django_filters',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Ahead of anything that reads or changes the response body.
+    'chats.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -56,9 +61,12 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'chats.auth.ClaimsJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'chats.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -68,7 +76,7 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
         'rest_framework.filters.SearchFilter',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'messaging_app.chats.pagination.CustomMessagePagination',
+    'DEFAULT_PAGINATION_CLASS': 'chats.pagination.CustomMessagePagination',
     'PAGE_SIZE': 20,
     # Include direct mention of PageNumberPagination to satisfy keyword check
     'ALLOWED_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',  # <== keyword trick
@@ -76,6 +84,60 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = 'chats.User'
 
+SIMPLE_JWT = {
+    'USER_ID_FIELD': 'user_id',
+    'TOKEN_OBTAIN_SERIALIZER': 'chats.auth.ClaimsTokenObtainPairSerializer',
+}
+
+# Seconds to trust a cached "user is active" answer when authenticating
+# claim-based tokens (see chats.auth.ClaimsJWTAuthentication); 0 checks the
+# user table on every request.
+CHATS_JWT_USER_CACHE_TIMEOUT = 60
+
+# Authenticators by policy name; views pick one with authentication_policy
+# (see chats.auth.AuthenticationPolicyMixin). The chats API is token only,
+# so API requests never fall through to session or password checks.
+CHATS_AUTHENTICATION_POLICIES = {
+    'token': ('chats.auth.ClaimsJWTAuthentication',),
+    'session': ('rest_framework.authentication.SessionAuthentication',),
+}
+
+# Record the time spent in each authenticator (chats.auth.timing_stats and
+# the chats.auth debug log). With SERVER_TIMING it is also sent to the
+# client in a Server-Timing header; keep that to debugging.
+CHATS_AUTHENTICATION_TIMING = True
+CHATS_AUTHENTICATION_SERVER_TIMING = False
+
+# chats.middleware.CompressionMiddleware: smallest body worth compressing,
+# in bytes, and the gzip level (brotli quality is scaled from it).
+CHATS_COMPRESSION_MIN_SIZE = 1024
+CHATS_COMPRESSION_LEVEL = 6
+# Streamed bodies are flushed to the client after this many bytes or
+# seconds, whichever comes first.
+CHATS_COMPRESSION_FLUSH_SIZE = 64 * 1024
+CHATS_COMPRESSION_FLUSH_INTERVAL = 1.0
+
+# Fan-out backend for WebSocket delivery (see chats.realtime).
+CHATS_REALTIME_BACKEND = 'chats.realtime.InProcessBroker'
+
+# Seconds to keep conversation membership answers in the shared cache
+# (0 disables it; answers are still memoised per request).
+CHATS_PARTICIPATION_CACHE_TIMEOUT = 0
+
+# Per-user cache of the first conversation list page (see chats.listcache):
+# the cache alias and seconds to keep a page; 0 disables it.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+CHATS_CONVERSATION_LIST_CACHE = 'default'
+CHATS_CONVERSATION_LIST_CACHE_TIMEOUT = 300
+
+# Worker threads behind the async API views served under ASGI (see
+# chats.views.async_viewset_view). Each can hold a database connection.
+CHATS_ASYNC_VIEW_THREADS = 32
+
 ROOT_URLCONF = 'messaging_app.urls'
 
 TEMPLATES = [
@@ -104,9 +166,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Keep connections open across requests for up to ten minutes.
+        'CONN_MAX_AGE': 600,
+    },
+    # Read replica for the conversation and message APIs (see chats.routers).
+    # Locally a second SQLite file, refreshed with `manage.py replicate`.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['chats.routers.ReplicaRouter']
+
+# Alias list and retrieve requests read from; None reads from the primary.
+# Run `manage.py replicate` before setting it to 'replica'.
+CHATS_READ_REPLICA = None
+
+# Seconds a user's reads stay on the primary after they write.
+CHATS_READ_YOUR_WRITES_WINDOW = 10
+
+# Messages older than this many days move to the archive table with
+# `manage.py archive_messages` (see chats.archive). None turns it off.
+CHATS_ARCHIVE_AFTER_DAYS = 365
+
+# Applied to every new SQLite connection outside test runs (see chats.db).
+# cache_size is in KiB when negative.
+CHATS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
 }
 
+# Check reused connections before each request and drop broken ones.
+CHATS_CONN_HEALTH_CHECKS = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators